@@ -7,3 +7,4 @@ class AccountsConfig(AppConfig):
 
     def ready(self):
         import accounts.extensions  # noqa
+        import accounts.principals  # noqa
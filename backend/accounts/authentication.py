@@ -2,9 +2,8 @@
 from rest_framework.authentication import BaseAuthentication
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework.exceptions import AuthenticationFailed
-from django.contrib.auth import get_user_model
 
-User = get_user_model()
+from accounts import principals
 
 
 class CookieJWTAuthentication(BaseAuthentication):
@@ -16,7 +15,11 @@ class CookieJWTAuthentication(BaseAuthentication):
         try:
             access_token = AccessToken(token)
             user_id = access_token["user_id"]
-            user = User.objects.get(id=user_id)
-            return (user, None)
         except Exception:
             raise AuthenticationFailed("Invalid token")
+
+        # Usually served from the principal cache, not the users table
+        user = principals.get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed("Invalid token")
+        return (user, None)
@@ -13,5 +13,12 @@ class User(AbstractUser):
     role = models.CharField(
         max_length=20, choices=Roles.choices, default=Roles.CUSTOMER)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # User directory: by role (and active flag) in username order
+            models.Index(fields=["role", "is_active", "username"],
+                         name="user_role_active_username"),
+        ]
+
     def __str__(self):
         return f"{self.username} ({self.role})"
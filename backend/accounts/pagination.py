@@ -0,0 +1,59 @@
+import json
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+
+
+def estimate_count(queryset):
+    """
+    Approximate number of rows of ``queryset`` without counting them.
+
+    On PostgreSQL this is the planner's row estimate for the query, read
+    from EXPLAIN; elsewhere an exact count that stops at
+    USERS_COUNT_LIMIT rows.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset[:settings.USERS_COUNT_LIMIT].count()
+
+    sql, params = queryset.values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pages of users ordered by their (unique) username, so a page
+    costs the same however deep into the table it is. ``?count=estimate``
+    adds an approximate total.
+    """
+    ordering = "username"
+    page_size = settings.USERS_PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = settings.USERS_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get("count") == "estimate":
+            self.count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data["count"] = self.count
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count"] = {
+            "type": "integer",
+            "description": "Approximate total, with ?count=estimate",
+        }
+        return response_schema
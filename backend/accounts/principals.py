@@ -0,0 +1,132 @@
+"""
+Cached user lookup for the cookie JWT authentication of the REST API and
+the websocket handshake.
+
+A user id from a valid access token is resolved from a small per-process
+LRU first (PRINCIPAL_LOCAL_TTL seconds), then from the shared cache
+(PRINCIPAL_CACHE_TTL seconds), and only then from the users table. Once a
+save or delete of a user commits, it is dropped from the shared cache and
+the local LRU of the process that did it; other processes see the change
+once their local entry expires. QuerySet.update() bypasses the signals,
+so use save() for changes that must take effect on authentication.
+
+Cached users are rebuilt from their field values without the password
+hash, which is loaded from the database if something reads it.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+User = get_user_model()
+
+CACHE_PREFIX = "accounts:principal:"
+# Everything but the password hash
+FIELDS = [field.attname for field in User._meta.concrete_fields
+          if field.attname != "password"]
+
+
+def cache_key(user_id):
+    return f"{CACHE_PREFIX}{user_id}"
+
+
+class LocalCache:
+    """
+    Thread-safe LRU of user field values with a per-entry expiry.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, values = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return values
+
+    def set(self, key, values):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, values)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache(settings.PRINCIPAL_CACHE_SIZE,
+                         settings.PRINCIPAL_LOCAL_TTL)
+
+
+def load(user_id):
+    """
+    Field values of the user from the database, None if there is none.
+    """
+    return User.objects.filter(id=user_id).values_list(*FIELDS).first()
+
+
+def build(values):
+    # A fresh instance per request: views may change the user they get
+    user = User.from_db(DEFAULT_DB_ALIAS, FIELDS, values)
+    return user if user.is_active else None
+
+
+def cached_user(user_id):
+    """
+    The active user from the local LRU without blocking, or None.
+    """
+    values = local_cache.get(str(user_id))
+    return build(values) if values is not None else None
+
+
+def get_user(user_id):
+    """
+    The active user with this id, or None if it doesn't exist or is
+    inactive.
+    """
+    key = str(user_id)
+    values = local_cache.get(key)
+    if values is None:
+        values = cache.get(cache_key(key))
+        if values is None:
+            values = load(user_id)
+            if values is None:
+                return None
+            cache.set(cache_key(key), values, settings.PRINCIPAL_CACHE_TTL)
+        local_cache.set(key, values)
+    return build(values)
+
+
+def invalidate(user_id):
+    local_cache.delete(str(user_id))
+    cache.delete(cache_key(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Only once committed: a lookup before that would re-read the old row
+    # and put it back in the shared cache
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate(user_id))
@@ -1,3 +1,108 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from accounts import principals
+from chat.middleware import get_user_from_token
+
+User = get_user_model()
+
+
+class PrincipalCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        principals.local_cache.clear()
+        self.user = User.objects.create_user(
+            username="agent", password="agent123", role=User.Roles.AGENT)
+        self.token = str(AccessToken.for_user(self.user))
+        self.client = APIClient()
+        self.client.cookies["access_token"] = self.token
+
+    def test_authenticated_requests_skip_the_users_table(self):
+        url = reverse("profile")
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data, {"username": "agent",
+                                         "role": "AGENT"})
+
+        # Only the local tier is lost, e.g. in another worker
+        principals.local_cache.clear()
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        # The password hash isn't cached, but still loads
+        user = principals.get_user(self.user.id)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password("agent123"))
+
+    def test_changes_to_the_user_are_seen_once_committed(self):
+        url = reverse("profile")
+        self.client.get(url)
+        key = principals.cache_key(self.user.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role = User.Roles.SUPERVISOR
+            self.user.save()
+            # A lookup before the commit would re-cache the old row
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.client.get(url).data["role"], "SUPERVISOR")
+        self.assertEqual(
+            async_to_sync(get_user_from_token)(self.token).role,
+            "SUPERVISOR")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertFalse(
+            async_to_sync(get_user_from_token)(self.token).is_authenticated)
+
+
+class UserDirectoryTests(TestCase):
+
+    def setUp(self):
+        User.objects.bulk_create(
+            [User(username=f"agent{i:02}", role=User.Roles.AGENT)
+             for i in range(5)] +
+            [User(username=f"customer{i:02}", role=User.Roles.CUSTOMER,
+                  is_active=i % 2 == 0)
+             for i in range(20)])
+        self.client = APIClient()
+        self.url = reverse("users")
+
+    def test_users_are_paged_in_username_order(self):
+        usernames = []
+        url = self.url + "?limit=10"
+        while url:
+            with self.assertNumQueries(1):
+                page = self.client.get(url).data
+            usernames += [user["username"] for user in page["results"]]
+            url = page["next"]
+
+        self.assertEqual(len(usernames), 25)
+        self.assertEqual(usernames, sorted(usernames))
+        self.assertEqual(set(page["results"][0]),
+                         {"id", "username", "email", "role"})
+
+    def test_filters_and_estimated_count(self):
+        page = self.client.get(self.url, {
+            "role": "CUSTOMER", "active": "true", "prefix": "customer1",
+            "count": "estimate",
+        }).data
+        self.assertEqual([user["username"] for user in page["results"]],
+                         ["customer10", "customer12", "customer14",
+                          "customer16", "customer18"])
+        self.assertEqual(page["count"], 5)
+        self.assertNotIn("count", self.client.get(self.url).data)
+
+        for params in [{"role": "ADMIN"}, {"active": "yes"}]:
+            self.assertEqual(
+                self.client.get(self.url, params).status_code, 400)
@@ -8,13 +8,15 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 
 from accounts.serializers import (
     ProfileResponseSerializer, RegisterSerializer, ListUserSerializer,
     LoginSerializer
 )
+from accounts.pagination import UserCursorPagination
 from accounts.permissions import IsSupervisor
 
 
@@ -111,9 +113,44 @@ class LogoutView(APIView):
         return response
 
 
+@extend_schema(parameters=[
+    OpenApiParameter("role", str, enum=User.Roles.values),
+    OpenApiParameter("active", bool),
+    OpenApiParameter("prefix", str, description="Username prefix"),
+    OpenApiParameter("limit", int, description=(
+        "Page size, at most USERS_MAX_PAGE_SIZE.")),
+    OpenApiParameter("count", str, enum=["estimate"], description=(
+        "Add an approximate total to the page.")),
+])
 class ListUsersView(generics.ListAPIView):
-    queryset = User.objects.all()
+    """
+    Users in username order, one keyset page at a time, optionally
+    filtered by role, active flag and username prefix.
+    """
     serializer_class = ListUserSerializer
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        # Only what ListUserSerializer emits
+        users = User.objects.only("id", "username", "email", "role")
+
+        role = params.get("role")
+        if role is not None:
+            if role not in User.Roles.values:
+                raise ValidationError({"role": "Unknown role"})
+            users = users.filter(role=role)
+
+        active = params.get("active")
+        if active is not None:
+            if active not in ("true", "false"):
+                raise ValidationError({"active": "Must be true or false"})
+            users = users.filter(is_active=active == "true")
+
+        prefix = params.get("prefix")
+        if prefix:
+            users = users.filter(username__startswith=prefix)
+        return users
 
 
 class DetailUsersView(generics.RetrieveUpdateDestroyAPIView):
@@ -0,0 +1,37 @@
+"""
+Conditional GET for the polled list endpoints.
+
+Views compute an ETag from a cheap indexed lookup (the conversation's
+last_seq, or the size and latest updated_at of a list) before loading any
+rows. A client presenting the same ETag in If-None-Match gets a 304
+without the list being built.
+
+There is deliberately no Last-Modified: a conversation leaving a list
+doesn't move the latest updated_at of the rest, and two messages can be
+stored within the same second, so If-Modified-Since would hide changes.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+def etag_for(*parts):
+    digest = hashlib.md5("|".join(str(part) for part in parts).encode(),
+                         usedforsecurity=False).hexdigest()
+    return quote_etag(digest)
+
+
+def not_modified(request, etag):
+    """
+    A 304 response if the request's If-None-Match matches, else None.
+    """
+    return get_conditional_response(request, etag=etag)
+
+
+def with_validators(response, etag):
+    response["ETag"] = etag
+    # Per user: the lists and their unread counts depend on who asks
+    response["Cache-Control"] = "private, no-cache"
+    response["Vary"] = "Cookie"
+    return response
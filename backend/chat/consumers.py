@@ -1,254 +1,404 @@
-import json
+import asyncio
+import time
 import uuid
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django_redis import get_redis_connection
+from django.conf import settings
+from . import (
+    frames, inbox, ingest, list_cache, metrics, participant_cache, presence,
+    replay
+)
 from .tasks import notify_offline_user
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-
-        self.client_id_set = set()
-
-        self.conversation_id = (self.scope['url_route']
-                                ['kwargs']
-                                ['conversation_id'])
-
-        print(self.conversation_id)
+class ConversationRoom:
+    """
+    Per-conversation state of a socket subscribed to that conversation.
+    Participants are cached for the lifetime of the subscription so the
+    message path does not need to re-read the conversation.
+    """
 
+    def __init__(self, conversation_id, participants):
+        self.conversation_id = str(conversation_id)
         self.group_name = f"conversation_{self.conversation_id}"
-        user = self.scope['user']
-        print("Connecting user:", user)
-        if not user.is_authenticated:
-            await self.close()
-            return
-
-        can_join = await self.user_can_join(user, self.conversation_id)
-        if not can_join:
-            await self.close()
-            return
-
+        self.participants = participants
+        self.is_typing = False
+        self.typing_sent_at = 0.0
+        self.typing_expiry = None
+
+
+class ConversationConsumerBase(frames.FrameConsumerMixin,
+                               AsyncWebsocketConsumer):
+    """
+    Conversation event handling shared by ChatConsumer (one conversation
+    per socket) and MultiplexChatConsumer (many conversations per socket).
+    Every frame sent to a conversation group is tagged with its id.
+    """
+
+    def init_socket(self):
+        # Bounded LRU of recently seen client ids; the unique
+        # (conversation, client_id) constraint covers reconnects and
+        # other nodes.
+        self.client_ids = OrderedDict()
+
+    async def join_room(self, user, conversation_id):
+        """
+        Authorize ``user`` for the conversation and subscribe the socket to
+        its group. Returns the room, or None if the user may not join.
+        """
+        participants = await self.get_participants(conversation_id)
+        if participants is not None and \
+                not self.user_can_join(user, participants):
+            # Confirm from the database: the entry may predate an accept
+            participants = await self.get_participants(conversation_id,
+                                                       fresh=True)
+        if not self.user_can_join(user, participants):
+            return None
+
+        room = ConversationRoom(conversation_id, participants)
         await self.channel_layer.group_add(
-            self.group_name,
+            room.group_name,
             self.channel_name
         )
-        await self.accept()
+        return room
 
-        redis_conn = get_redis_connection("default")
-        redis_conn.hset("online_users", user.username, user.role)
+    async def leave_room(self, user, room):
+        # Don't leave a typing indicator stuck on the other side
+        if room.is_typing:
+            await self.set_typing(user, room, False)
 
-        await self.channel_layer.group_send(
-            "presence_updates",
-            {
-                "type": "user_online",
-                "user": user.username,
-                "role": user.role,
-            },
+        await self.channel_layer.group_discard(
+            room.group_name,
+            self.channel_name
         )
 
+    async def announce_presence(self, user, online):
+        # Supervisors get the change in the next batched presence diff
+        if online:
+            await presence.mark_online(user.username, user.role,
+                                       self.channel_name)
+        else:
+            await presence.mark_offline(user.username, self.channel_name)
+
+    async def announce_join(self, user, room):
         await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "chat.join",
+            room.group_name,
+            frames.event("chat.join", {
+                "type": "user.join",
+                "conversation": room.conversation_id,
                 "user": user.username,
                 "role": "supervisor" if user.role ==
                 "SUPERVISOR" else user.role.lower(),
-            },
+            }),
         )
 
-    async def disconnect(self, close_code):
-        user = self.scope["user"]
-
-        redis_conn = get_redis_connection("default")
-        redis_conn.hdel("online_users", user.username)
-
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
-
-        await self.channel_layer.group_send(
-            "presence_updates",
-            {
-                "type": "user_offline",
-                "user": user.username,
-            },
-        )
+        # Messages sent while this participant was offline are delivered now;
+        # one receipt covers all of them.
+        if user.role != "SUPERVISOR" and \
+                await self.mark_delivered(room.conversation_id, user):
+            await replay.publish(
+                self.channel_layer, room, "chat.delivered", {
+                    "type": "message.delivered",
+                    "conversation": room.conversation_id,
+                    "recipient": user.username,
+                },
+            )
 
-    async def receive(self, text_data):
+    async def replay_missed(self, room, cursor):
+        """
+        Send the events of ``room`` the client missed after ``cursor``,
+        followed by a "replay.done" frame.
+        """
+        if not replay.valid_cursor(cursor):
+            return
 
-        redis_conn = get_redis_connection("default")
-        data = json.loads(text_data)
-        user = self.scope["user"]
+        events = await replay.missed_since(room.conversation_id, cursor)
+        complete = True
+        if events is None:
+            metrics.incr("replay.database")
+            payloads, complete = await database_sync_to_async(
+                replay.messages_since)(room.conversation_id, cursor)
+            events = [("chat.message", payload) for payload in payloads]
+        else:
+            metrics.incr("replay.buffer")
+
+        for _, payload in events:
+            await self.send_payload(payload)
+        # Not complete: too much was missed, reload the history over HTTP
+        await self.send_payload({"type": "replay.done",
+                                 "conversation": room.conversation_id,
+                                 "complete": complete})
+
+    async def handle_event(self, user, room, data):
         msg_type = data.get("type")
 
-        print(user)
-
         if msg_type in ["typing.start", "typing.stop"]:
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "chat.typing",
-                    "event": msg_type,
-                    "user": user.username,
-                },
-            )
+            await self.handle_typing(user, room, msg_type == "typing.start")
             return
 
         if msg_type == "message":
             message = data.get("message", "").strip()
-            client_id = data.get("client_id") or str(uuid.uuid4())
+            client_id = str(data.get("client_id") or "")[:64] or None
 
-            if client_id in self.client_id_set:
+            if client_id and self.seen_client_id(room, client_id):
                 return
-            self.client_id_set.add(client_id)
 
             if not message:
                 return
 
-            # Save message to DB
-            msg_obj = await self.save_message(user, self.conversation_id,
-                                              message)
-
-            conversation = await self.get_conversation(self.conversation_id)
-
-            if user.role == "CUSTOMER":
-                recipient = conversation.agent
-            else:
-                recipient = conversation.customer
+            recipient = self.get_recipient(user, room)
+            if recipient is None and user.role == "CUSTOMER":
+                # The agent may have accepted after the customer connected
+                room.participants = await self.get_participants(
+                    room.conversation_id, fresh=True)
+                recipient = self.get_recipient(user, room)
 
             status = "sent"
+            if recipient and await presence.is_online(
+                    recipient["username"]):
+                status = "delivered"
+
+            if settings.CHAT_INGEST_MODE == "stream":
+                # Persisted later by `manage.py persist_messages`
+                msg_obj = await ingest.enqueue_message(
+                    room.conversation_id, user, message, status, client_id)
+            else:
+                # Save message to DB with its final status in a single insert
+                msg_obj = await self.save_message(
+                    room.conversation_id, user, message, status, client_id)
+            if msg_obj is None:
+                # Retry of a message that was already stored
+                metrics.incr("message.duplicate")
+                return
 
-            if recipient:
-
-                is_online = redis_conn.hexists(
-                    "online_users", recipient.username)
-
-                if is_online:
-                    await self.mark_as_delivered(msg_obj.id)
-                    status = "delivered"
-                else:
-                    notify_offline_user.delay(recipient.email, message)
-
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "chat.message",
-                    "id": msg_obj.id,
-                    "content": message,
-                    "sender": user.username,
-                    "timestamp": msg_obj.timestamp.isoformat(),
-                    "status": status,
-                },
+            if recipient and status == "sent":
+                notify_offline_user.delay(recipient["email"], message)
+
+            timestamp = msg_obj.timestamp.isoformat()
+            agent = room.participants["agent"]
+            await asyncio.gather(
+                replay.publish(
+                    self.channel_layer, room, "chat.message", {
+                        "type": "message",
+                        "conversation": room.conversation_id,
+                        "id": str(msg_obj.id),
+                        "seq": msg_obj.seq,
+                        "content": message,
+                        "sender": user.username,
+                        "timestamp": timestamp,
+                        "status": status,
+                    },
+                ),
+                inbox.message_preview(
+                    self.channel_layer, room.conversation_id,
+                    agent["id"] if agent else None, user.username, message,
+                    timestamp),
             )
 
         elif msg_type == "message.read":
-            message_id = data.get("id")
+            # "seq" (from the message frame) is a read-up-to receipt: every
+            # message from the other party up to it is marked read with it.
+            if user.role == "SUPERVISOR":
+                return
             try:
-                await self.mark_as_read(message_id)
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {"type": "chat.read", "id": message_id,
-                     "reader": user.username},
+                seq = int(data.get("seq"))
+            except (TypeError, ValueError):
+                return
+            if seq < 1:
+                return
+            advanced = await self.mark_read_up_to(
+                room.conversation_id, user, seq)
+            if advanced:
+                if room.participants["agent"] is None:
+                    # The agent may have accepted after the reader connected
+                    room.participants = await self.get_participants(
+                        room.conversation_id, fresh=True)
+                agent = room.participants["agent"]
+                await asyncio.gather(
+                    replay.publish(
+                        self.channel_layer, room, "chat.read", {
+                            "type": "message.read",
+                            "conversation": room.conversation_id,
+                            "seq": seq,
+                            "reader": user.username,
+                        },
+                    ),
+                    # Unread counts and updated_at are shown in the lists
+                    sync_to_async(list_cache.invalidate)(
+                        agent["id"] if agent else None,
+                        open=room.participants["status"] == "OPEN"),
                 )
-            except Exception:
-                # Safe fail if message not found
-                print(f"Message {message_id} not found to mark as read.")
-
-    async def chat_typing(self, event):
-        await self.send(text_data=json.dumps({
-            "type": event["event"],  # typing.start / typing.stop
-            "user": event["user"],
-        }))
-
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "message",
-            "id": event["id"],
-            "content": event["content"],
-            "sender": event["sender"],
-            "timestamp": event["timestamp"],
-            "status": event["status"],
-        }))
-
-    async def chat_read(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "message.read",
-            "id": event["id"],
-            "reader": event["reader"],
-        }))
-
-    async def chat_join(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "user.join",
-            "user": event["user"],
-            "role": event["role"],
-        }))
-
-    async def user_online(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "presence.online",
-            "user": event["user"],
-            "role": event["role"]
-        }))
-
-    async def user_offline(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "presence.offline",
-            "user": event["user"]
-        }))
 
-    @database_sync_to_async
-    def save_message(self, user, conversation_id, message):
-        from .models import Conversation, Message
+    def seen_client_id(self, room, client_id):
+        key = (room.conversation_id, client_id)
+        if key in self.client_ids:
+            self.client_ids.move_to_end(key)
+            return True
+        self.client_ids[key] = None
+        if len(self.client_ids) > settings.CLIENT_ID_CACHE_SIZE:
+            self.client_ids.popitem(last=False)
+        return False
+
+    async def handle_typing(self, user, room, typing):
+        """
+        Forward only typing transitions, re-sending "typing.start" at most
+        every TYPING_START_INTERVAL seconds while the user keeps typing.
+        A start without a matching stop expires after TYPING_TIMEOUT.
+        """
+        if typing:
+            if room.typing_expiry:
+                room.typing_expiry.cancel()
+            room.typing_expiry = asyncio.create_task(
+                self.expire_typing(user, room))
+
+            interval = settings.TYPING_START_INTERVAL
+            if room.is_typing and \
+                    time.monotonic() - room.typing_sent_at < interval:
+                metrics.incr("typing.suppressed")
+                return
+        elif not room.is_typing:
+            metrics.incr("typing.suppressed")
+            return
 
-        conversation = Conversation.objects.get(id=conversation_id)
-        return Message.objects.create(conversation=conversation, sender=user,
-                                      content=message, status="sent")
+        await self.set_typing(user, room, typing)
 
-    @database_sync_to_async
-    def mark_as_read(self, message_id):
-        from .models import Message
-        try:
-            msg = Message.objects.get(id=message_id)
-            if msg.status != "read":
-                msg.status = "read"
-                msg.save()
-        except Message.DoesNotExist:
-            pass
+    async def expire_typing(self, user, room):
+        await asyncio.sleep(settings.TYPING_TIMEOUT)
+        room.typing_expiry = None
+        if room.is_typing:
+            metrics.incr("typing.expired")
+            await self.set_typing(user, room, False)
+
+    async def set_typing(self, user, room, typing):
+        if not typing and room.typing_expiry:
+            room.typing_expiry.cancel()
+            room.typing_expiry = None
+        room.is_typing = typing
+        room.typing_sent_at = time.monotonic()
+        metrics.incr("typing.forwarded")
+
+        await self.channel_layer.group_send(
+            room.group_name,
+            frames.event("chat.typing", {
+                "type": "typing.start" if typing else "typing.stop",
+                "conversation": room.conversation_id,
+                "user": user.username,
+            }),
+        )
+
+    # Frames are encoded once by the sender, see chat.frames
+    chat_message = chat_read = chat_delivered = frames.forward_frame
+    chat_typing = chat_join = frames.forward_frame
 
     @database_sync_to_async
-    def mark_as_delivered(self, message_id):
+    def save_message(self, conversation_id, user, message, status,
+                     client_id=None):
+        """
+        Insert the message with the next sequence number of the
+        conversation; returns None if ``client_id`` was already used in this
+        conversation (a client retry).
+        """
+        from django.db import IntegrityError
         from .models import Message
+
         try:
-            msg = Message.objects.get(id=message_id)
-            if msg.status == "sent":
-                msg.status = "delivered"
-                msg.save()
-        except Message.DoesNotExist:
-            pass
+            return Message.objects.create(
+                conversation_id=conversation_id, sender=user,
+                content=message, status=status, client_id=client_id)
+        except IntegrityError:
+            if client_id is None:
+                raise
+            return None
 
     @database_sync_to_async
-    def user_can_join(self, user, conversation_id):
-        from .models import Conversation
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            # Supervisors can join ANY conversation
-            if user.role == "SUPERVISOR":
-                return True
-            if user.role == "AGENT" and conversation.agent == user:
-                return True
-            if user.role == "CUSTOMER" and conversation.customer == user:
-                return True
-            return False
-        except Conversation.DoesNotExist:
-            return False
+    def mark_read_up_to(self, conversation_id, user, seq):
+        """
+        Mark every message from the other party up to ``seq`` as read in
+        one UPDATE, then advance the user's read watermark and lower their
+        unread count in another. Returns True if anything changed.
+
+        By seq rather than message id or timestamp: timestamps tie and, in
+        stream mode, come from different nodes' clocks, and the message may
+        not be persisted yet. persist_messages stores the messages under the
+        watermark as read.
+        """
+        from django.db.models import (
+            Case, F, PositiveBigIntegerField, Q, Value, When
+        )
+        from django.db.models.functions import Greatest
+        from django.utils import timezone
+        from .models import Conversation, Message
+
+        unread = Message.objects.filter(
+            conversation_id=conversation_id,
+            seq__lte=seq,
+            status__in=["sent", "delivered"],
+        )
+        if user.role == "CUSTOMER":
+            unread = unread.exclude(sender=user)
+            field, counter = "customer_last_read_seq", "customer_unread_count"
+        else:
+            # Agents read what the customer wrote
+            unread = unread.filter(sender_id=F("conversation__customer_id"))
+            field, counter = "agent_last_read_seq", "agent_unread_count"
+        updated = unread.update(status="read")
+
+        # update() skips auto_now; updated_at feeds the list validators
+        behind = Q(**{f"{field}__lt": seq})
+        if updated:
+            Conversation.objects.filter(id=conversation_id).update(**{
+                field: Case(When(behind, then=Value(seq)), default=F(field),
+                            output_field=PositiveBigIntegerField()),
+                counter: Greatest(F(counter) - updated, 0),
+                "updated_at": timezone.now(),
+            })
+            return True
+        moved = Conversation.objects.filter(
+            behind, id=conversation_id,
+        ).update(**{field: seq, "updated_at": timezone.now()})
+        return bool(moved)
 
     @database_sync_to_async
-    def get_conversation(self, conversation_id):
-        from .models import Conversation
-        return Conversation.objects.get(id=conversation_id)
+    def mark_delivered(self, conversation_id, user):
+        """
+        Mark every pending message addressed to ``user`` as delivered in one
+        UPDATE. Returns the number of messages updated.
+        """
+        from .models import Message
+
+        return Message.objects.filter(
+            conversation_id=conversation_id, status="sent"
+        ).exclude(sender=user).update(status="delivered")
+
+    async def get_participants(self, conversation_id, fresh=False):
+        """
+        Conversation status and its customer/agent, from the shared
+        participant cache unless ``fresh``. Returns None if the
+        conversation does not exist.
+        """
+        return await participant_cache.get(conversation_id, fresh=fresh)
+
+    def user_can_join(self, user, participants):
+        if participants is None:
+            return False
+        # Supervisors can join ANY conversation
+        if user.role == "SUPERVISOR":
+            return True
+        agent = participants["agent"]
+        if user.role == "AGENT" and agent and agent["id"] == user.id:
+            return True
+        if user.role == "CUSTOMER" and \
+                participants["customer"]["id"] == user.id:
+            return True
+        return False
+
+    def get_recipient(self, user, room):
+        if user.role == "CUSTOMER":
+            return room.participants["agent"]
+        return room.participants["customer"]
 
     # @database_sync_to_async
     # def user_in_conversation(self, user, conversation_id):
@@ -263,31 +413,183 @@ class ChatConsumer(AsyncWebsocketConsumer):
     #         return False
 
 
-class AgentConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(ConversationConsumerBase):
     async def connect(self):
-        self.agent_id = self.scope["user"].id
-        self.group_name = f"agent_{self.agent_id}"
+        self.init_socket()
+        self.room = None
+
+        conversation_id = (self.scope['url_route']
+                           ['kwargs']
+                           ['conversation_id'])
+
+        print(conversation_id)
+
+        user = self.scope['user']
+        print("Connecting user:", user)
+        if not user.is_authenticated:
+            await self.close()
+            return
 
-        if not self.scope["user"].is_authenticated or \
-                self.scope["user"].role != "AGENT":
+        self.room = await self.join_room(user, conversation_id)
+        if self.room is None:
             await self.close()
             return
 
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
+        await self.accept_frames()
+
+        # The presence write and the broadcasts are independent, so run
+        # them concurrently instead of paying sequential round trips.
+        await asyncio.gather(
+            self.announce_presence(user, True),
+            self.announce_join(user, self.room),
         )
-        await self.accept()
+
+        # Reconnecting clients pass the last cursor they applied
+        # (ws/chat/<id>/?cursor=...) and only get what they missed
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        cursor = query.get("cursor", [None])[0]
+        if cursor:
+            await self.replay_missed(self.room, cursor)
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
+        if self.room is None:
+            return
+        user = self.scope["user"]
+
+        await asyncio.gather(
+            self.leave_room(user, self.room),
+            self.announce_presence(user, False),
         )
 
-    async def new_conversation(self, event):
-        await self.send_json({
-            "type": "new_conversation",
-            "conversation_id": event["conversation_id"],
-            "customer": event["customer"]
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+        await self.handle_event(self.scope["user"], self.room, data)
+
+
+class MultiplexChatConsumer(ConversationConsumerBase):
+    """
+    One socket carrying many conversations, e.g. an agent handling several
+    chats. Clients send {"type": "subscribe", "conversation": <id>} (and
+    "unsubscribe") and tag every other event with "conversation"; frames
+    going out are tagged the same way. A subscribe may carry the last
+    "cursor" applied for that conversation to replay what was missed.
+    """
+
+    async def connect(self):
+        self.init_socket()
+        self.rooms = {}
+        self.online = False
+
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            await self.close()
+            return
+
+        await self.accept_frames()
+        await self.announce_presence(user, True)
+        self.online = True
+
+    async def disconnect(self, close_code):
+        if not self.online:
+            return
+        user = self.scope["user"]
+
+        await asyncio.gather(
+            *(self.leave_room(user, room) for room in self.rooms.values()),
+            self.announce_presence(user, False),
+        )
+        self.rooms = {}
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+        user = self.scope["user"]
+        msg_type = data.get("type")
+        conversation_id = str(data.get("conversation") or "")
+        try:
+            conversation_id = str(uuid.UUID(conversation_id))
+        except ValueError:
+            pass  # subscribe rejects it; anything else isn't subscribed
+
+        if msg_type == "subscribe":
+            await self.subscribe(user, conversation_id, data.get("cursor"))
+            return
+
+        if msg_type == "unsubscribe":
+            room = self.rooms.pop(conversation_id, None)
+            if room:
+                await self.leave_room(user, room)
+            await self.send_payload({"type": "unsubscribed",
+                                     "conversation": conversation_id})
+            return
+
+        room = self.rooms.get(conversation_id)
+        if room is None:
+            await self.send_error(conversation_id, "Not subscribed")
+            return
+        await self.handle_event(user, room, data)
+
+    async def subscribe(self, user, conversation_id, cursor=None):
+        try:
+            # The canonical spelling used for group, stream and room names
+            conversation_id = str(uuid.UUID(conversation_id))
+        except ValueError:
+            await self.send_error(conversation_id, "Invalid conversation")
+            return
+
+        if conversation_id not in self.rooms:
+            if len(self.rooms) >= settings.MULTIPLEX_MAX_CONVERSATIONS:
+                await self.send_error(conversation_id,
+                                      "Too many conversations")
+                return
+
+            room = await self.join_room(user, conversation_id)
+            if room is None:
+                await self.send_error(conversation_id, "Not authorized")
+                return
+            self.rooms[room.conversation_id] = room
+            await self.announce_join(user, room)
+
+        await self.send_payload({"type": "subscribed",
+                                 "conversation": conversation_id})
+        if cursor:
+            await self.replay_missed(self.rooms[conversation_id], cursor)
+
+    async def send_error(self, conversation_id, detail):
+        await self.send_payload({"type": "error",
+                                 "conversation": conversation_id,
+                                 "detail": detail})
+
+
+class AgentConsumer(frames.FrameConsumerMixin, AsyncWebsocketConsumer):
+    """
+    Live inbox for agents: a compact snapshot on connect, then deltas
+    published through chat.inbox, so agents never poll
+    agents/conversations/.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        self.groups_joined = []
+
+        if not user.is_authenticated or user.role != "AGENT":
+            await self.close()
+            return
+
+        self.groups_joined = [inbox.INBOX_GROUP, inbox.agent_group(user.id)]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept_frames()
+
+        await self.send_payload({
+            "type": "inbox.snapshot",
+            "conversations": await database_sync_to_async(inbox.snapshot)(
+                user),
         })
+
+    async def disconnect(self, close_code):
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    # Frames are encoded once by the publisher, see chat.inbox
+    conversation_opened = conversation_assigned = frames.forward_frame
+    conversation_closed = message_preview = frames.forward_frame
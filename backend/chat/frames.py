@@ -0,0 +1,116 @@
+"""
+Outbound websocket frames, encoded once by the sender.
+
+Events put on the channel layer carry the finished frame so every
+recipient consumer just forwards it instead of rebuilding and re-encoding
+the same payload.
+
+Clients that offer the ``chat.msgpack`` subprotocol at handshake get binary
+MessagePack frames with short keys (see COMPACT_KEYS) instead of JSON text.
+Events only carry the JSON frame; consumers of msgpack sockets convert it
+when forwarding, so deployments without msgpack clients pay nothing extra.
+"""
+import json
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "chat.msgpack"
+
+# Long key -> short key used on the msgpack subprotocol. Keys not listed
+# are sent unchanged.
+COMPACT_KEYS = {
+    "type": "t",
+    "conversation": "cv",
+    "id": "i",
+    "content": "c",
+    "sender": "s",
+    "timestamp": "ts",
+    "status": "st",
+    "user": "u",
+    "username": "un",
+    "users": "us",
+    "role": "r",
+    "reader": "rd",
+    "recipient": "rc",
+    "message": "m",
+    "client_id": "ci",
+    "conversations": "cs",
+    "customer": "cu",
+    "agent": "a",
+    "preview": "p",
+    "updated_at": "ua",
+    "version": "v",
+    "cursor": "cr",
+    "seq": "sq",
+}
+EXPANDED_KEYS = {short: key for key, short in COMPACT_KEYS.items()}
+
+# Compact separators; ``default=str`` covers UUIDs and datetimes.
+_encoder = json.JSONEncoder(separators=(",", ":"), default=str)
+
+
+def _rename_keys(value, keys):
+    if isinstance(value, dict):
+        return {keys.get(k, k): _rename_keys(v, keys)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rename_keys(v, keys) for v in value]
+    return value
+
+
+def encode(payload):
+    return _encoder.encode(payload)
+
+
+def encode_binary(payload):
+    return msgpack.packb(_rename_keys(payload, COMPACT_KEYS), default=str)
+
+
+def decode_binary(data):
+    return _rename_keys(msgpack.unpackb(data), EXPANDED_KEYS)
+
+
+def event(handler, payload):
+    """
+    Build a channel layer event for ``handler`` (e.g. "chat.message")
+    carrying ``payload`` as a pre-encoded JSON frame.
+    """
+    return {"type": handler, "text": encode(payload)}
+
+
+class FrameConsumerMixin:
+    """
+    Wire format negotiation for AsyncWebsocketConsumer subclasses.
+    JSON text frames stay the default.
+    """
+    binary_frames = False
+
+    async def accept_frames(self):
+        if MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            self.binary_frames = True
+            await self.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+        else:
+            await self.accept()
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return decode_binary(bytes_data)
+        return json.loads(text_data)
+
+    async def send_payload(self, payload):
+        if self.binary_frames:
+            await self.send(bytes_data=encode_binary(payload))
+        else:
+            await self.send(text_data=encode(payload))
+
+
+async def forward_frame(consumer, event):
+    """
+    Channel layer handler forwarding a pre-encoded frame; assign it to the
+    handler names in a FrameConsumerMixin consumer class body.
+    """
+    if consumer.binary_frames:
+        await consumer.send(
+            bytes_data=encode_binary(json.loads(event["text"])))
+    else:
+        await consumer.send(text_data=event["text"])
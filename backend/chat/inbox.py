@@ -0,0 +1,99 @@
+"""
+Live agent inbox.
+
+AgentConsumer sends a compact snapshot on connect and then only deltas:
+conversations opened, assigned, closed and new message previews. Views and
+consumers publish the deltas through the helpers below.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from . import frames
+
+# Every connected agent: unassigned (OPEN) conversations are visible to all
+INBOX_GROUP = "agent_inbox"
+PREVIEW_LENGTH = 100
+
+
+def agent_group(agent_id):
+    return f"agent_{agent_id}"
+
+
+def conversation_row(conversation):
+    return {
+        "id": str(conversation.id),
+        "status": conversation.status,
+        "customer": conversation.customer.username,
+        "updated_at": conversation.updated_at.isoformat(),
+    }
+
+
+def snapshot(agent):
+    """
+    Open conversations plus the ones assigned to ``agent``, without any
+    message history, in one query.
+    """
+    from django.db.models import Q
+    from .models import Conversation
+
+    rows = Conversation.objects.filter(
+        Q(status=Conversation.Status.OPEN) |
+        Q(status=Conversation.Status.ASSIGNED, agent=agent)
+    ).order_by("-updated_at").values(
+        "id", "status", "customer__username", "updated_at")
+    return [
+        {
+            "id": str(row["id"]),
+            "status": row["status"],
+            "customer": row["customer__username"],
+            "updated_at": row["updated_at"].isoformat(),
+        }
+        for row in rows
+    ]
+
+
+def publish(group, handler, payload):
+    async_to_sync(get_channel_layer().group_send)(
+        group, frames.event(handler, payload))
+
+
+def conversation_opened(conversation):
+    publish(INBOX_GROUP, "conversation.opened", {
+        "type": "conversation.opened",
+        "conversation": conversation_row(conversation),
+    })
+
+
+def conversation_assigned(conversation):
+    # Sent to every agent: the assignee moves it to its own list, the
+    # others drop it from the open list.
+    publish(INBOX_GROUP, "conversation.assigned", {
+        "type": "conversation.assigned",
+        "conversation": conversation_row(conversation),
+        "agent": conversation.agent.username,
+    })
+
+
+def conversation_closed(conversation):
+    if conversation.agent_id is None:
+        return
+    publish(agent_group(conversation.agent_id), "conversation.closed", {
+        "type": "conversation.closed",
+        "conversation": str(conversation.id),
+    })
+
+
+async def message_preview(channel_layer, conversation_id, agent_id,
+                          sender, content, timestamp):
+    """
+    Tell the assigned agent, or every agent while the conversation is
+    still unassigned, about a new message.
+    """
+    group = agent_group(agent_id) if agent_id else INBOX_GROUP
+    await channel_layer.group_send(group, frames.event("message.preview", {
+        "type": "message.preview",
+        "conversation": str(conversation_id),
+        "sender": sender,
+        "preview": content[:PREVIEW_LENGTH],
+        "timestamp": timestamp,
+    }))
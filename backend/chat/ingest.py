@@ -0,0 +1,147 @@
+"""
+Write-behind message ingest.
+
+With ``CHAT_INGEST_MODE = "stream"`` the consumer assigns the message id and
+timestamp itself, appends the message to a per-shard Redis Stream and
+broadcasts it straight away; messages posted over REST take the same
+route. ``manage.py persist_messages`` drains the
+streams into Postgres with ``bulk_create`` and only acknowledges entries
+once the batch has been committed.
+
+Sequence numbers come from a per-conversation Redis counter, seeded from
+``Conversation.last_seq`` the first time, and are taken in the same script
+that appends the entry so stream order matches sequence order.
+"""
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .redis_pool import get_redis
+
+CONSUMER_GROUP = "persisters"
+# Where persist_messages sets aside the entries it can't store
+DEAD_LETTER_KEY = "chat:ingest:dead"
+
+# KEYS: seq counter, stream. ARGV: counter ttl, entry field/value pairs.
+# Returns the message's sequence number, or nil if the counter has not been
+# seeded from the database yet.
+APPEND_MESSAGE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+local seq = redis.call('INCR', KEYS[1])
+redis.call('XADD', KEYS[2], '*', 'seq', seq, unpack(ARGV, 2))
+return seq
+"""
+
+
+def stream_key(shard):
+    return f"chat:ingest:{shard}"
+
+
+def shard_for(conversation_id):
+    # All lines of one conversation land on the same shard, so a single
+    # persister writes them in order.
+    return uuid.UUID(str(conversation_id)).int % settings.CHAT_INGEST_SHARDS
+
+
+def stream_keys():
+    return [stream_key(shard) for shard in range(settings.CHAT_INGEST_SHARDS)]
+
+
+def client_id_key(conversation_id, client_id):
+    return f"chat:client_id:{conversation_id}:{client_id}"
+
+
+def seq_key(conversation_id):
+    return f"chat:seq:{conversation_id}"
+
+
+def stored_last_seq(conversation_id):
+    from .models import Conversation
+
+    return Conversation.objects.filter(id=conversation_id).values_list(
+        "last_seq", flat=True).first() or 0
+
+
+async def enqueue_message(conversation_id, sender, content, status,
+                          client_id=None):
+    """
+    Append a message to its ingest stream and return an unsaved Message
+    carrying the server-assigned id, timestamp and sequence number.
+    Returns None if ``client_id`` was already enqueued recently.
+    """
+    from .models import Message
+
+    msg = Message(
+        id=uuid.uuid4(),
+        conversation_id=conversation_id,
+        sender=sender,
+        content=content,
+        status=status,
+        timestamp=timezone.now(),
+        client_id=client_id,
+    )
+    redis = get_redis()
+    fields = {
+        "id": str(msg.id),
+        "conversation_id": str(conversation_id),
+        "sender_id": str(sender.id),
+        "content": content,
+        "status": status,
+        "timestamp": msg.timestamp.isoformat(),
+    }
+    if client_id:
+        # Claim the client id before appending; the unique constraint
+        # still catches retries that arrive after the key expired.
+        claimed = await redis.set(client_id_key(conversation_id, client_id),
+                                  str(msg.id), nx=True,
+                                  ex=settings.CLIENT_ID_TTL)
+        if not claimed:
+            return None
+        fields["client_id"] = client_id
+
+    keys = [seq_key(conversation_id), stream_key(shard_for(conversation_id))]
+    args = [settings.CHAT_SEQ_TTL]
+    for name, value in fields.items():
+        args += [name, value]
+    append = redis.register_script(APPEND_MESSAGE)
+
+    seq = await append(keys=keys, args=args)
+    if seq is None:
+        # First message since the counter expired: seed it from the
+        # database (NX, another worker may have been first)
+        last_seq = await database_sync_to_async(stored_last_seq)(
+            conversation_id)
+        await redis.set(keys[0], last_seq, nx=True,
+                        ex=settings.CHAT_SEQ_TTL)
+        seq = await append(keys=keys, args=args)
+    msg.seq = seq
+    return msg
+
+
+def message_from_entry(fields):
+    """
+    Build an unsaved Message from a raw (bytes) stream entry. Raises
+    KeyError or ValueError if the entry is malformed.
+    """
+    from .models import Message
+
+    fields = {key.decode(): value.decode() for key, value in fields.items()}
+    timestamp = parse_datetime(fields["timestamp"])
+    if timestamp is None:
+        raise ValueError(f"bad timestamp {fields['timestamp']!r}")
+    return Message(
+        id=uuid.UUID(fields["id"]),
+        conversation_id=uuid.UUID(fields["conversation_id"]),
+        sender_id=uuid.UUID(fields["sender_id"]),
+        content=fields["content"],
+        status=fields["status"],
+        timestamp=timestamp,
+        client_id=fields.get("client_id"),
+        seq=int(fields["seq"]),
+    )
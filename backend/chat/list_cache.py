@@ -0,0 +1,68 @@
+"""
+Shared cache of the agent and supervisor conversation lists.
+
+Entries live in the django_redis cache under a key made of the list's
+scope and the current version of every part of the conversation set it
+shows: "active" (every OPEN or ASSIGNED conversation, the supervisor list),
+"open" (the unassigned queue) and "agent:<id>" (one agent's assigned
+conversations). Whatever changes a conversation bumps the versions it
+touches, so later requests miss and rebuild; stale entries are never read
+again and expire after CHAT_LIST_CACHE_TTL.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+ACTIVE = "active"
+OPEN = "open"
+
+
+def version_key(part):
+    return f"chat:lists:version:{part}"
+
+
+def agent_part(agent_id):
+    return f"agent:{agent_id}"
+
+
+def parts_of(scope):
+    if scope == "supervisor":
+        return [ACTIVE]
+    # "agent:<id>": the open queue plus the agent's own conversations
+    return [OPEN, scope]
+
+
+def lookup(scope):
+    """
+    (key, entry) of the cached list of ``scope``; entry is None on a miss
+    and the list should be stored under ``key``.
+    """
+    keys = [version_key(part) for part in parts_of(scope)]
+    versions = cache.get_many(keys)
+    key = ":".join(["chat:lists", scope] +
+                   [versions.get(k, "0") for k in keys])
+    entry = cache.get(key)
+    metrics.incr("list_cache.miss" if entry is None else "list_cache.hit")
+    return key, entry
+
+
+def store(key, entry):
+    cache.set(key, entry, settings.CHAT_LIST_CACHE_TTL)
+
+
+def invalidate(*agent_ids, open=False):
+    """
+    Bump the versions of the lists showing a changed conversation: the
+    supervisor list always, every agent's if it is (or was) in the open
+    queue, and those of the agents it is (or was) assigned to.
+    """
+    parts = [ACTIVE]
+    if open:
+        parts.append(OPEN)
+    parts.extend(agent_part(agent_id) for agent_id in agent_ids if agent_id)
+    token = uuid.uuid4().hex
+    cache.set_many({version_key(part): token for part in parts},
+                   timeout=None)
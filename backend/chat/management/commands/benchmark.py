@@ -0,0 +1,261 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+
+async def _measure_loop_stall(work, interval=0.001):
+    """
+    Run ``work`` while a ticker sleeps ``interval`` seconds in a loop and
+    records how late each tick wakes up. Late wake-ups are time the event
+    loop was blocked and could not serve any other websocket.
+    """
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            stalls.append(max(0.0, time.perf_counter() - start - interval))
+
+    tick_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick_task
+    return elapsed, stalls
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmarks for the chat hot paths (needs Redis/Postgres)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=["presence", "fanout", "auth",
+                                                 "assign"])
+        parser.add_argument("--iterations", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['scenario']}")(options["iterations"])
+
+    def report(self, label, elapsed, stalls):
+        stalls = sorted(stalls) or [0.0]
+        self.stdout.write(
+            f"{label:<28} total={elapsed * 1000:8.1f}ms "
+            f"stall_sum={sum(stalls) * 1000:8.1f}ms "
+            f"stall_max={stalls[-1] * 1000:6.2f}ms "
+            f"stall_p99={stalls[int(len(stalls) * 0.99)] * 1000:6.2f}ms"
+        )
+
+    def bench_presence(self, iterations):
+        """
+        Event-loop stall of blocking django_redis calls versus the asyncio
+        presence store for the connect/receive/disconnect pattern.
+        """
+        from django_redis import get_redis_connection
+        from chat import presence
+
+        usernames = [f"bench_user_{i}" for i in range(iterations)]
+
+        async def blocking():
+            redis_conn = get_redis_connection("default")
+            for username in usernames:
+                redis_conn.hset(presence.ONLINE_USERS_KEY, username, "AGENT")
+                redis_conn.hexists(presence.ONLINE_USERS_KEY, username)
+                redis_conn.hdel(presence.ONLINE_USERS_KEY, username)
+                await asyncio.sleep(0)
+
+        async def non_blocking():
+            for username in usernames:
+                await presence.mark_online(username, "AGENT", "bench")
+                await presence.is_online(username)
+                await presence.mark_offline(username, "bench")
+
+        async def run():
+            self.report("django_redis (blocking)",
+                        *await _measure_loop_stall(blocking))
+            self.report("presence (asyncio)",
+                        *await _measure_loop_stall(non_blocking))
+
+        asyncio.run(run())
+
+    def bench_fanout(self, iterations):
+        """
+        CPU cost per recipient of building and encoding a chat.message frame
+        in every handler versus forwarding a frame encoded once, then the
+        cost and channel layer size of the event itself with and without
+        a msgpack copy of the frame.
+        """
+        import json
+        import uuid
+
+        import msgpack
+        from django.utils import timezone
+        from chat import frames
+
+        recipients = 100
+        payload = {
+            "type": "message",
+            "id": str(uuid.uuid4()),
+            "content": "Hello, I need help with my order." * 4,
+            "sender": "customer1",
+            "timestamp": timezone.now().isoformat(),
+            "status": "delivered",
+        }
+
+        def per_recipient():
+            event = dict(payload, type="chat.message")
+            for _ in range(recipients):
+                json.dumps({
+                    "type": "message",
+                    "id": event["id"],
+                    "content": event["content"],
+                    "sender": event["sender"],
+                    "timestamp": event["timestamp"],
+                    "status": event["status"],
+                })
+
+        def encoded_once():
+            event = frames.event("chat.message", payload)
+            for _ in range(recipients):
+                event["text"]
+
+        for label, fan_out in [("json.dumps per recipient", per_recipient),
+                               ("pre-encoded frame", encoded_once)]:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                fan_out()
+            elapsed = time.perf_counter() - started
+            per_call = elapsed / (iterations * recipients) * 1e9
+            self.stdout.write(f"{label:<28} {per_call:8.1f}ns/recipient")
+
+        def with_binary_copy():
+            return dict(frames.event("chat.message", payload),
+                        bytes=frames.encode_binary(payload))
+
+        def json_only():
+            return frames.event("chat.message", payload)
+
+        for label, build in [("event + msgpack copy", with_binary_copy),
+                             ("event, JSON only", json_only)]:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                build()
+            elapsed = time.perf_counter() - started
+            # channels_redis serializes events with msgpack
+            size = len(msgpack.packb(build(), use_bin_type=True))
+            self.stdout.write(
+                f"{label:<28} {elapsed / iterations * 1e9:8.1f}ns/event "
+                f"layer_bytes={size}")
+
+    def bench_auth(self, iterations):
+        """
+        Time per request spent authenticating the access_token cookie with
+        a users table lookup versus the shared and local principal caches.
+        """
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from django.test import RequestFactory
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        from accounts import principals
+        from accounts.authentication import CookieJWTAuthentication
+
+        User = get_user_model()
+        username = "bench_auth_user"
+        User.objects.filter(username=username).delete()
+        user = User.objects.create(username=username,
+                                   role=User.Roles.CUSTOMER)
+        request = RequestFactory().get("/")
+        request.COOKIES["access_token"] = str(AccessToken.for_user(user))
+        authentication = CookieJWTAuthentication()
+
+        def database():
+            user_id = AccessToken(request.COOKIES["access_token"])["user_id"]
+            User.objects.get(id=user_id)
+
+        def shared_cache():
+            principals.local_cache.clear()
+            authentication.authenticate(request)
+
+        def local_cache():
+            authentication.authenticate(request)
+
+        try:
+            for label, authenticate in [("users table", database),
+                                        ("shared cache", shared_cache),
+                                        ("local cache", local_cache)]:
+                authenticate()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for _ in range(iterations):
+                        authenticate()
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{label:<28} {elapsed / iterations * 1e6:8.1f}"
+                    f"us/request queries={len(queries)}")
+        finally:
+            # Also drops it from the principal caches
+            user.delete()
+
+    def bench_assign(self, iterations, agents=500):
+        """
+        Time and queries to pick the least busy of 500 online agents with a
+        count query per agent versus one aggregate query.
+        """
+        import random
+
+        from django.contrib.auth import get_user_model
+        from django.db import connection, reset_queries
+        from django.test.utils import CaptureQueriesContext
+        from django_redis import get_redis_connection
+
+        from chat import presence
+        from chat.models import Conversation
+        from chat.utils import least_busy_agent
+
+        User = get_user_model()
+        prefix = "bench_assign_"
+        User.objects.filter(username__startswith=prefix).delete()
+        customer = User.objects.create(username=f"{prefix}customer",
+                                       role=User.Roles.CUSTOMER)
+        staff = User.objects.bulk_create([
+            User(username=f"{prefix}agent{i:03}", role=User.Roles.AGENT)
+            for i in range(agents)
+        ])
+        Conversation.objects.bulk_create([
+            Conversation(customer=customer, agent=agent,
+                         status=random.choice(["ASSIGNED", "CLOSED"]))
+            for agent in staff for _ in range(random.randint(0, 6))
+        ])
+        usernames = [agent.username for agent in staff]
+        redis_conn = get_redis_connection("default")
+        redis_conn.sadd(presence.role_key("AGENT"), *usernames)
+
+        def per_agent():
+            online = User.objects.filter(role="AGENT",
+                                         username__in=usernames)
+            min(online, key=lambda a: a.agent_conversations.filter(
+                status="ASSIGNED").count())
+
+        def aggregate():
+            least_busy_agent(usernames)
+
+        try:
+            for label, pick in [("count per agent", per_agent),
+                                ("one aggregate query", aggregate)]:
+                reset_queries()
+                with CaptureQueriesContext(connection) as queries:
+                    pick()
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    pick()
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{label:<28} {elapsed / iterations * 1000:8.2f}"
+                    f"ms/assignment queries={len(queries)}")
+        finally:
+            redis_conn.srem(presence.role_key("AGENT"), *usernames)
+            User.objects.filter(username__startswith=prefix).delete()
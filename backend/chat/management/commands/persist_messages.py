@@ -0,0 +1,229 @@
+import os
+import socket
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from chat import list_cache
+from chat.inbox import PREVIEW_LENGTH
+from chat.ingest import (
+    CONSUMER_GROUP, DEAD_LETTER_KEY, message_from_entry, stream_keys
+)
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Drain the chat ingest Redis Streams into Postgres in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--block-ms", type=int, default=1000)
+        parser.add_argument(
+            "--claim-idle-ms", type=int, default=60000,
+            help="Take over entries left pending this long by a dead worker.")
+        parser.add_argument(
+            "--consumer", default=f"{socket.gethostname()}-{os.getpid()}")
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Exit once the streams are drained.")
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection("default")
+        keys = stream_keys()
+        for key in keys:
+            try:
+                redis_conn.xgroup_create(key, CONSUMER_GROUP, id="0",
+                                         mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+        self.stdout.write(f"Persisting {', '.join(keys)} as "
+                          f"{options['consumer']}")
+        while True:
+            written = self.claim_stale(redis_conn, keys, options)
+            entries = redis_conn.xreadgroup(
+                CONSUMER_GROUP, options["consumer"],
+                {key: ">" for key in keys},
+                count=options["batch_size"],
+                block=None if options["once"] else options["block_ms"],
+            )
+            for key, items in entries or []:
+                written += self.persist(redis_conn, key, items)
+
+            if written:
+                self.stdout.write(f"Persisted {written} message(s)")
+            elif options["once"]:
+                return
+
+    def claim_stale(self, redis_conn, keys, options):
+        written = 0
+        for key in keys:
+            _, items, _ = redis_conn.xautoclaim(
+                key, CONSUMER_GROUP, options["consumer"],
+                min_idle_time=options["claim_idle_ms"],
+                count=options["batch_size"],
+            )
+            written += self.persist(redis_conn, key, items)
+        return written
+
+    def persist(self, redis_conn, key, items):
+        """
+        Store a batch of stream entries, then acknowledge all of them.
+        Entries that can't be stored are moved to the dead-letter stream
+        rather than left pending, where they would come back with every
+        claim and hold up the rest of the shard.
+        """
+        # Entries trimmed while pending come back as (id, None)
+        ids = [entry_id for entry_id, _ in items]
+        if not ids:
+            return 0
+
+        entries, dead = [], []
+        for entry_id, fields in items:
+            if not fields:
+                continue
+            try:
+                entries.append((entry_id, fields, message_from_entry(fields)))
+            except (KeyError, ValueError) as e:
+                dead.append((entry_id, fields, f"unparsable: {e!r}"))
+
+        try:
+            written, rejected = self.write(entries)
+        except (IntegrityError, DataError):
+            # Find the culprits one entry at a time; the rest still goes in
+            written, rejected = 0, []
+            for entry in entries:
+                try:
+                    count, missing = self.write([entry])
+                except (IntegrityError, DataError) as e:
+                    rejected.append((entry[0], entry[1], repr(e)))
+                else:
+                    written += count
+                    rejected += missing
+        dead += rejected
+
+        if dead:
+            self.dead_letter(redis_conn, key, dead)
+        # Only acknowledge once the batch is committed
+        redis_conn.xack(key, CONSUMER_GROUP, *ids)
+        redis_conn.xdel(key, *ids)
+        return written
+
+    def write(self, entries):
+        """
+        Insert the messages of ``entries`` in one transaction. Returns the
+        number written and the entries skipped because their conversation
+        or sender no longer exists.
+        """
+        with transaction.atomic():
+            # Lock the conversations first: concurrent persisters of a
+            # redelivered batch then agree on which messages are new.
+            conversations = Conversation.objects.select_for_update().filter(
+                id__in={m.conversation_id for _, _, m in entries}
+            ).values_list("id", "customer_id", "agent_id", "status",
+                          "customer_last_read_seq", "agent_last_read_seq")
+            customers, read_up_to, agents, open_queue = {}, {}, set(), False
+            for conversation_id, customer_id, agent_id, status, \
+                    customer_read, agent_read in conversations:
+                customers[conversation_id] = customer_id
+                read_up_to[conversation_id] = (customer_read, agent_read)
+                agents.add(agent_id)
+                open_queue |= status == Conversation.Status.OPEN
+            senders = set(User.objects.filter(
+                id__in={m.sender_id for _, _, m in entries}
+            ).values_list("id", flat=True))
+
+            messages, missing = [], []
+            for entry_id, fields, message in entries:
+                if message.conversation_id not in customers:
+                    missing.append((entry_id, fields, "conversation deleted"))
+                elif message.sender_id not in senders:
+                    missing.append((entry_id, fields, "sender deleted"))
+                else:
+                    # Receipts are keyed on seq and may arrive before the
+                    # message is stored: under the reader's watermark it is
+                    # already read.
+                    customer_read, agent_read = read_up_to[
+                        message.conversation_id]
+                    from_customer = (message.sender_id ==
+                                     customers[message.conversation_id])
+                    if message.seq <= (agent_read if from_customer
+                                       else customer_read):
+                        message.status = "read"
+                    messages.append(message)
+
+            stored = set(Message.objects.filter(
+                id__in=[m.id for m in messages]).values_list("id", flat=True))
+            messages = [m for m in messages if m.id not in stored]
+
+            # No ignore_conflicts: with redeliveries filtered out above, a
+            # conflict is a (conversation, seq) or client_id collision, and
+            # the entry has to end up in the dead-letter stream rather than
+            # be dropped and still counted.
+            Message.objects.bulk_create(messages)
+            self.update_conversations(messages, customers)
+
+        if messages:
+            list_cache.invalidate(*agents, open=open_queue)
+        return len(messages), missing
+
+    def dead_letter(self, redis_conn, key, dead):
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for entry_id, fields, reason in dead:
+                pipe.xadd(DEAD_LETTER_KEY, {
+                    **fields, "stream": key, "entry_id": entry_id,
+                    "reason": reason,
+                }, maxlen=settings.CHAT_DEAD_LETTER_LENGTH, approximate=True)
+            pipe.execute()
+        self.stderr.write(f"Moved {len(dead)} entry(ies) of {key} to "
+                          f"{DEAD_LETTER_KEY}")
+
+    def update_conversations(self, messages, customers):
+        """
+        Apply what Conversation.record_message() does per message in the
+        direct ingest mode, once per conversation of the batch.
+        """
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id,
+                                       []).append(message)
+
+        for conversation_id, batch in by_conversation.items():
+            customer_id = customers.get(uuid.UUID(str(conversation_id)))
+            last = max(batch, key=lambda m: m.seq)
+            unread = [m for m in batch if m.status != "read"]
+            from_customer = sum(
+                1 for m in unread if str(m.sender_id) == str(customer_id))
+            # The last message fields only move forward (CASE sees the row
+            # as it was before the UPDATE). last_seq keeps the database
+            # counter ahead of the stored sequence numbers for when the
+            # Redis counter has to be seeded again.
+            newest = Q(last_seq__lte=last.seq)
+            Conversation.objects.filter(id=conversation_id).update(
+                last_seq=Greatest("last_seq", last.seq),
+                message_count=F("message_count") + len(batch),
+                last_message_at=Case(
+                    When(newest, then=Value(last.timestamp)),
+                    default=F("last_message_at")),
+                last_message_preview=Case(
+                    When(newest, then=Value(last.content[:PREVIEW_LENGTH])),
+                    default=F("last_message_preview")),
+                last_message_sender_id=Case(
+                    When(newest, then=Value(uuid.UUID(str(last.sender_id)))),
+                    default=F("last_message_sender_id")),
+                updated_at=timezone.now(),
+                agent_unread_count=F("agent_unread_count") + from_customer,
+                customer_unread_count=(F("customer_unread_count") +
+                                       len(unread) - from_customer),
+            )
@@ -0,0 +1,33 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import presence
+
+
+class Command(BaseCommand):
+    help = ("Expire presence leases of connections whose worker stopped "
+            "renewing them, and publish the resulting offline diffs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float,
+            default=settings.PRESENCE_HEARTBEAT_INTERVAL)
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Run a single sweep and exit.")
+
+    def handle(self, *args, **options):
+        asyncio.run(self.sweep(options["interval"], options["once"]))
+
+    async def sweep(self, interval, once):
+        while True:
+            offline = await presence.sweep_expired()
+            if offline:
+                await presence.batcher.flush()
+                self.stdout.write(f"Expired presence of {len(offline)} "
+                                  f"user(s): {', '.join(offline)}")
+            if once:
+                return
+            await asyncio.sleep(interval)
@@ -0,0 +1,17 @@
+"""
+Per-process counters for the chat hot paths.
+
+Counters live in memory of the ASGI worker that incremented them; they are
+meant for spotting trends, not for exact accounting across nodes.
+"""
+from collections import Counter
+
+counters = Counter()
+
+
+def incr(name, amount=1):
+    counters[name] += amount
+
+
+def snapshot():
+    return dict(sorted(counters.items()))
@@ -3,20 +3,24 @@ from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import TokenError
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from django.contrib.auth import get_user_model
 
-User = get_user_model()
+from accounts import principals
 
 
-@database_sync_to_async
-def get_user_from_token(token_str):
+async def get_user_from_token(token_str):
     try:
         access_token = AccessToken(token_str)
         user_id = access_token["user_id"]
-        return User.objects.get(id=user_id)
-    except (TokenError, User.DoesNotExist):
+    except (TokenError, KeyError):
         return AnonymousUser()
 
+    # A local cache hit needs no thread hop; otherwise the shared cache or
+    # the database is read in the DB thread pool
+    user = principals.cached_user(user_id)
+    if user is None:
+        user = await database_sync_to_async(principals.get_user)(user_id)
+    return user or AnonymousUser()
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     """
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+# Number existing messages 1, 2, ... per conversation in timestamp order
+# and record the highest number on the conversation.
+BACKFILL_SEQ = """
+UPDATE chat_message
+SET seq = numbered.seq
+FROM (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY conversation_id ORDER BY timestamp, id
+    ) AS seq
+    FROM chat_message
+) AS numbered
+WHERE chat_message.id = numbered.id;
+
+UPDATE chat_conversation
+SET last_seq = COALESCE((
+    SELECT MAX(seq) FROM chat_message
+    WHERE chat_message.conversation_id = chat_conversation.id
+), 0);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_SEQ, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('conversation', 'seq'), name='unique_message_seq'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Fill the counters of existing conversations from their messages
+BACKFILL_COUNTERS = """
+UPDATE chat_conversation
+SET message_count = (
+        SELECT COUNT(*) FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+    ),
+    last_message_at = (
+        SELECT m.timestamp FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        ORDER BY m.seq DESC LIMIT 1
+    ),
+    last_message_preview = COALESCE((
+        SELECT SUBSTR(m.content, 1, 100) FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        ORDER BY m.seq DESC LIMIT 1
+    ), ''),
+    last_message_sender_id = (
+        SELECT m.sender_id FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        ORDER BY m.seq DESC LIMIT 1
+    ),
+    customer_unread_count = (
+        SELECT COUNT(*) FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        AND m.status IN ('sent', 'delivered')
+        AND m.sender_id <> chat_conversation.customer_id
+    ),
+    agent_unread_count = (
+        SELECT COUNT(*) FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        AND m.status IN ('sent', 'delivered')
+        AND m.sender_id = chat_conversation.customer_id
+    );
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='agent_unread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='customer_unread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_COUNTERS, migrations.RunSQL.noop),
+    ]
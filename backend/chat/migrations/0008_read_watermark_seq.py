@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+# Carry the timestamp watermarks over as the seq of the last message
+# stored at or before them
+BACKFILL_WATERMARKS = """
+UPDATE chat_conversation
+SET customer_last_read_seq = COALESCE((
+        SELECT MAX(m.seq) FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        AND m.timestamp <= chat_conversation.customer_last_read_at
+    ), 0),
+    agent_last_read_seq = COALESCE((
+        SELECT MAX(m.seq) FROM chat_message m
+        WHERE m.conversation_id = chat_conversation.id
+        AND m.timestamp <= chat_conversation.agent_last_read_at
+    ), 0);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='agent_last_read_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='customer_last_read_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_WATERMARKS, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='agent_last_read_at',
+        ),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='customer_last_read_at',
+        ),
+    ]
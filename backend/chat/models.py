@@ -1,10 +1,31 @@
 import uuid
-from django.db import models
+from django.db import connection, models, transaction
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from . import list_cache
+
 User = get_user_model()
 
 
+class ConversationQuerySet(models.QuerySet):
+
+    def with_summary(self, user):
+        """
+        Join in the participants and the last message's sender, and
+        annotate the unread count of ``user``'s side of the conversation, so
+        a list of summaries is a single query reading denormalized columns.
+        Agents and supervisors see the agent's unread count.
+        """
+        from django.db.models import F
+
+        unread = ("customer_unread_count" if user.role == "CUSTOMER"
+                  else "agent_unread_count")
+        return self.select_related(
+            "customer", "agent", "last_message_sender"
+        ).annotate(unread_count=F(unread))
+
+
 class Conversation(models.Model):
     class Status(models.TextChoices):
         OPEN = "OPEN", "Open"
@@ -31,10 +52,106 @@ class Conversation(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Read watermarks: everything from the other party up to this seq has
+    # been read by the participant.
+    customer_last_read_seq = models.PositiveBigIntegerField(default=0,
+                                                            editable=False)
+    agent_last_read_seq = models.PositiveBigIntegerField(default=0,
+                                                         editable=False)
+    # Highest Message.seq handed out in this conversation
+    last_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    # Denormalized from the messages, maintained by record_message() and
+    # the read receipts, so lists and badges never scan Message
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True,
+                                           editable=False)
+    last_message_preview = models.CharField(max_length=100, blank=True,
+                                            editable=False)
+    last_message_sender = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+"
+    )
+    # Messages the participant has not read yet: from the customer for the
+    # agent, from the agent (or a supervisor) for the customer
+    customer_unread_count = models.PositiveIntegerField(default=0,
+                                                        editable=False)
+    agent_unread_count = models.PositiveIntegerField(default=0,
+                                                     editable=False)
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Customer's own conversations / their open one
+            models.Index(fields=["customer", "status"],
+                         name="conversation_customer_status"),
+            # Agent's assigned conversations and load counts
+            models.Index(fields=["agent", "status"],
+                         name="conversation_agent_status"),
+            # Supervisor list: active statuses, most recent first
+            models.Index(fields=["status", "-updated_at"],
+                         name="conversation_status_updated"),
+            # Agent inbox: the unassigned queue only
+            models.Index(fields=["-updated_at"],
+                         condition=models.Q(status="OPEN"),
+                         name="conversation_open_updated"),
+        ]
 
     def __str__(self):
         return f"Conversation {self.id} ({self.status})"
 
+    @staticmethod
+    def record_message(message):
+        """
+        Reserve the next sequence number for ``message`` and update the
+        denormalized counters (and updated_at, which the list validators
+        rely on) in a single UPDATE ... RETURNING. The row
+        stays locked until the surrounding transaction ends, so concurrent
+        senders are serialized and a rolled back insert undoes both.
+
+        Returns the sequence number and the conversation's status and
+        agent id.
+        """
+        from .inbox import PREVIEW_LENGTH
+
+        sender_id = User._meta.pk.get_db_prep_value(message.sender_id,
+                                                    connection)
+        unread = 0 if message.status == "read" else 1
+        timestamp = Message._meta.get_field("timestamp").get_db_prep_value(
+            message.timestamp, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Conversation._meta.db_table} SET "
+                "last_seq = last_seq + 1, "
+                "message_count = message_count + 1, "
+                "last_message_at = %s, "
+                "updated_at = %s, "
+                "last_message_preview = %s, "
+                "last_message_sender_id = %s, "
+                "customer_unread_count = customer_unread_count + "
+                "CASE WHEN customer_id = %s THEN 0 ELSE %s END, "
+                "agent_unread_count = agent_unread_count + "
+                "CASE WHEN customer_id = %s THEN %s ELSE 0 END "
+                "WHERE id = %s RETURNING last_seq, status, agent_id",
+                [
+                    timestamp,
+                    timestamp,
+                    message.content[:PREVIEW_LENGTH],
+                    sender_id, sender_id, unread, sender_id, unread,
+                    Conversation._meta.pk.get_db_prep_value(
+                        uuid.UUID(str(message.conversation_id)), connection),
+                ],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise Conversation.DoesNotExist(message.conversation_id)
+        seq, status, agent_id = row
+        return seq, status, uuid.UUID(str(agent_id)) if agent_id else None
+
 
 class Message(models.Model):
 
@@ -46,13 +163,54 @@ class Message(models.Model):
     )
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind ingest assigns the timestamp when the
+    # message is broadcast and persists it later.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     status = models.CharField(
         max_length=10,
         choices=[('sent', 'Sent'), ('delivered',
                                     'Delivered'), ('read', 'Read')],
         default='sent'
     )
+    # Client-generated id used to make send retries idempotent
+    client_id = models.CharField(max_length=64, null=True, blank=True)
+    # Position in the conversation (1, 2, ...) without gaps; orders messages
+    # and lets clients detect missed ones.
+    seq = models.PositiveBigIntegerField(editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "seq"],
+                name="unique_message_seq",
+            ),
+            models.UniqueConstraint(
+                fields=["conversation", "client_id"],
+                condition=models.Q(client_id__isnull=False),
+                name="unique_message_client_id",
+            ),
+        ]
+        indexes = [
+            # Only for the replay fallback and the messages ``since``
+            # filter; receipts and pages go by seq
+            models.Index(fields=["conversation", "timestamp"],
+                         name="message_conversation_time"),
+            # Delivery and read updates only touch unread messages
+            models.Index(fields=["conversation", "sender"],
+                         condition=models.Q(status__in=["sent", "delivered"]),
+                         name="message_unread"),
+        ]
 
     def __str__(self):
         return f"Message {self.id} from {self.sender.username}"
+
+    def save(self, *args, **kwargs):
+        if self.seq is None:
+            with transaction.atomic():
+                self.seq, status, agent_id = Conversation.record_message(self)
+                super().save(*args, **kwargs)
+                # The preview and unread count shown in the lists changed
+                transaction.on_commit(lambda: list_cache.invalidate(
+                    agent_id, open=status == Conversation.Status.OPEN))
+                return
+        return super().save(*args, **kwargs)
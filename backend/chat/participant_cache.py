@@ -0,0 +1,94 @@
+"""
+Shared cache of who takes part in a conversation, so websocket handshakes
+and subscriptions authorize without reading the conversation row.
+
+Entries hold the conversation status and its customer and agent (id,
+username, email) under ``chat:participants:<id>`` in Redis for
+CHAT_PARTICIPANTS_TTL seconds. Accepting, closing or auto-assigning a
+conversation deletes its entry; the consumer also re-reads the database
+before turning a user away, so an entry refilled from a read that raced
+with an accept can't lock the new agent out.
+"""
+import json
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from . import metrics
+from .redis_pool import get_redis
+
+KEY_PREFIX = "chat:participants:"
+
+
+def cache_key(conversation_id):
+    return f"{KEY_PREFIX}{conversation_id}"
+
+
+def load(conversation_id):
+    """
+    Load the conversation status and its customer/agent in one query.
+    Returns None if the conversation does not exist.
+    """
+    from .models import Conversation
+
+    row = Conversation.objects.filter(id=conversation_id).values(
+        "status",
+        "customer_id", "customer__username", "customer__email",
+        "agent_id", "agent__username", "agent__email",
+    ).first()
+    if row is None:
+        return None
+
+    agent = None
+    if row["agent_id"]:
+        agent = {
+            "id": row["agent_id"],
+            "username": row["agent__username"],
+            "email": row["agent__email"],
+        }
+    return {
+        "status": row["status"],
+        "customer": {
+            "id": row["customer_id"],
+            "username": row["customer__username"],
+            "email": row["customer__email"],
+        },
+        "agent": agent,
+    }
+
+
+def decode(raw):
+    participants = json.loads(raw)
+    # Ids are compared with user.id, a UUID
+    for role in ("customer", "agent"):
+        if participants[role]:
+            participants[role]["id"] = uuid.UUID(participants[role]["id"])
+    return participants
+
+
+async def get(conversation_id, fresh=False):
+    """
+    The participants of the conversation from Redis, or from the database
+    on a miss or if ``fresh``. Returns None if the conversation does not
+    exist.
+    """
+    redis = get_redis()
+    key = cache_key(conversation_id)
+    if not fresh:
+        raw = await redis.get(key)
+        if raw is not None:
+            metrics.incr("participants.hit")
+            return decode(raw)
+        metrics.incr("participants.miss")
+
+    participants = await database_sync_to_async(load)(conversation_id)
+    if participants is not None:
+        await redis.set(key, json.dumps(participants, default=str),
+                        ex=settings.CHAT_PARTICIPANTS_TTL)
+    return participants
+
+
+def invalidate(conversation_id):
+    get_redis_connection("default").delete(cache_key(conversation_id))
@@ -0,0 +1,395 @@
+"""
+Online presence backed by the ``online_users`` Redis hash.
+
+All calls go through the asyncio Redis client so a slow Redis never blocks
+the event loop the websocket consumers run on.
+
+Every websocket holds a lease in the ``presence:leases`` sorted set (scored
+by expiry) and the leases are refcounted per user, so a user stays online
+until their last connection on any node goes away. Each worker renews the
+leases of its live connections every PRESENCE_HEARTBEAT_INTERVAL seconds
+and takes back any that were swept while its renewals were failing; leases
+of a crashed worker expire after PRESENCE_LEASE_TTL and are released by
+``manage.py sweep_presence``. ``online_users`` is only written
+by the scripts below, so it always matches the live leases.
+
+Changes are not broadcast one by one: each worker coalesces them for
+PRESENCE_FLUSH_INTERVAL seconds and publishes a single versioned
+"presence.diff" batch, with the current per-role counts, to supervisors.
+The last PRESENCE_DIFF_HISTORY batches are kept in Redis so a supervisor
+can resync from the version it last applied instead of reloading the whole
+snapshot.
+
+Online users are also indexed in one ``presence:role:<ROLE>`` set per role,
+so the snapshot only carries agents, supervisors and the per-role counts;
+customers, who can be tens of thousands, are paged on demand with SSCAN.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import frames
+from .redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+ONLINE_USERS_KEY = "online_users"
+VERSION_KEY = "presence:version"
+DIFFS_KEY = "presence:diffs"
+LEASES_KEY = "presence:leases"
+REFCOUNT_KEY = "presence:refcount"
+ROLE_KEY_PREFIX = "presence:role:"
+PRESENCE_GROUP = "presence_updates"
+PRESENCE_KEYS = [LEASES_KEY, REFCOUNT_KEY, ONLINE_USERS_KEY]
+ROLES = ["AGENT", "SUPERVISOR", "CUSTOMER"]
+# Roles listed in full in the snapshot; the others are paged
+SNAPSHOT_ROLES = ["AGENT", "SUPERVISOR"]
+MAX_PAGE_SIZE = 1000
+
+# The per-role sets are named from ARGV[5] plus the role kept in
+# online_users, so these scripts assume a single (non-cluster) Redis.
+
+# KEYS: leases, refcount, online_users.
+# ARGV: lease, username, role, expiry, role key prefix.
+# Returns the user's connection count, or -1 if the lease already existed.
+ACQUIRE_LEASE = """
+if redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1]) == 0 then
+    return -1
+end
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[3])
+redis.call('SADD', ARGV[5] .. ARGV[3], ARGV[2])
+return redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+"""
+
+# KEYS: leases, refcount, online_users.
+# ARGV: lease, username, role key prefix.
+# Returns the remaining connection count, or -1 if the lease was gone.
+RELEASE_LEASE = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local count = redis.call('HINCRBY', KEYS[2], ARGV[2], -1)
+if count <= 0 then
+    local role = redis.call('HGET', KEYS[3], ARGV[2])
+    if role then
+        redis.call('SREM', ARGV[3] .. role, ARGV[2])
+    end
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    redis.call('HDEL', KEYS[3], ARGV[2])
+    return 0
+end
+return count
+"""
+
+# KEYS: leases, refcount, online_users. ARGV: now, limit, role key prefix.
+# Releases up to ``limit`` expired leases; returns users now offline.
+SWEEP_LEASES = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                           'LIMIT', 0, ARGV[2])
+local offline = {}
+for _, lease in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], lease)
+    local username = string.match(lease, '|(.*)$')
+    if redis.call('HINCRBY', KEYS[2], username, -1) <= 0 then
+        local role = redis.call('HGET', KEYS[3], username)
+        if role then
+            redis.call('SREM', ARGV[3] .. role, username)
+        end
+        redis.call('HDEL', KEYS[2], username)
+        redis.call('HDEL', KEYS[3], username)
+        table.insert(offline, username)
+    end
+end
+return offline
+"""
+
+# KEYS: leases. ARGV: expiry, leases.
+# Renews the leases that still exist (never resurrecting one the sweeper
+# released) and returns the ones that are gone.
+RENEW_LEASES = """
+local missing = {}
+for i = 2, #ARGV do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[i])
+    else
+        table.insert(missing, ARGV[i])
+    end
+end
+return missing
+"""
+
+
+class DiffBatcher:
+    """Coalesces presence changes of this worker into versioned batches."""
+
+    def __init__(self):
+        # username -> role while online, None once offline; the last
+        # change in a flush window wins. The diff itself is built from the
+        # state in Redis at flush time.
+        self.pending = {}
+        self.flush_task = None
+
+    def record(self, username, role):
+        self.pending[username] = role
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(settings.PRESENCE_FLUSH_INTERVAL)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        changes, self.pending = self.pending, {}
+        if not changes:
+            return
+
+        redis = get_redis()
+        usernames = list(changes)
+        # The users' current state and the absolute counts are read together
+        # with the version. Another worker may have changed a user since the
+        # buffered transition (and flushed an older version), and a snapshot
+        # taken while these changes were pending already includes them, so
+        # supervisors overwrite rather than replay or add up changes.
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(VERSION_KEY)
+            pipe.hmget(ONLINE_USERS_KEY, usernames)
+            for role in ROLES:
+                pipe.scard(role_key(role))
+            version, roles, *counts = await pipe.execute()
+        batch = {
+            "version": version,
+            "counts": dict(zip(ROLES, counts)),
+            "online": [{"username": username, "role": role.decode()}
+                       for username, role in zip(usernames, roles) if role],
+            "offline": [username
+                        for username, role in zip(usernames, roles)
+                        if not role],
+        }
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(DIFFS_KEY, {frames.encode(batch): batch["version"]})
+            pipe.zremrangebyrank(DIFFS_KEY, 0,
+                                 -settings.PRESENCE_DIFF_HISTORY - 1)
+            await pipe.execute()
+
+        await get_channel_layer().group_send(
+            PRESENCE_GROUP,
+            frames.event("presence.diff", {"type": "presence.diff", **batch}),
+        )
+
+
+class LeaseKeeper:
+    """
+    Renews the leases of this worker's live connections with one script call
+    per heartbeat, instead of one timer per connection.
+    """
+
+    def __init__(self):
+        # lease -> (username, role)
+        self.leases = {}
+        self.heartbeat_task = None
+
+    def add(self, lease, username, role):
+        self.leases[lease] = (username, role)
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self.heartbeat())
+
+    def discard(self, lease):
+        self.leases.pop(lease, None)
+
+    async def heartbeat(self):
+        try:
+            while self.leases:
+                await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+                try:
+                    await self.renew()
+                except Exception:
+                    # Keep going: without renewals every lease of this
+                    # worker expires and its users are swept offline
+                    logger.exception("Renewing presence leases failed")
+        finally:
+            self.heartbeat_task = None
+
+    async def renew(self):
+        if not self.leases:
+            return
+        missing = await get_redis().register_script(RENEW_LEASES)(
+            keys=[LEASES_KEY], args=[lease_expiry(), *self.leases])
+        for lease in missing:
+            lease = lease.decode()
+            if lease not in self.leases:
+                continue
+            # Swept after renewals failed, but the connection is still
+            # here: take the lease again (and announce the user online)
+            username, role = self.leases[lease]
+            await acquire(lease, username, role)
+            if lease not in self.leases:
+                # Disconnected while it was being re-acquired
+                await release(lease, username)
+
+
+batcher = DiffBatcher()
+keeper = LeaseKeeper()
+
+
+def lease_for(username, connection_id):
+    return f"{connection_id}|{username}"
+
+
+def lease_expiry():
+    return time.time() + settings.PRESENCE_LEASE_TTL
+
+
+async def acquire(lease, username, role):
+    count = await get_redis().register_script(ACQUIRE_LEASE)(
+        keys=PRESENCE_KEYS,
+        args=[lease, username, role, lease_expiry(), ROLE_KEY_PREFIX])
+    if count == 1:
+        batcher.record(username, role)
+
+
+async def release(lease, username):
+    count = await get_redis().register_script(RELEASE_LEASE)(
+        keys=PRESENCE_KEYS, args=[lease, username, ROLE_KEY_PREFIX])
+    if count == 0:
+        batcher.record(username, None)
+
+
+async def mark_online(username, role, connection_id):
+    lease = lease_for(username, connection_id)
+    await acquire(lease, username, role)
+    keeper.add(lease, username, role)
+
+
+async def mark_offline(username, connection_id):
+    lease = lease_for(username, connection_id)
+    keeper.discard(lease)
+    await release(lease, username)
+
+
+async def sweep_expired(limit=1000):
+    """
+    Release leases whose worker stopped renewing them (e.g. it crashed).
+    Returns the usernames that went offline.
+    """
+    offline = await get_redis().register_script(SWEEP_LEASES)(
+        keys=PRESENCE_KEYS, args=[time.time(), limit, ROLE_KEY_PREFIX])
+    offline = [username.decode() for username in offline]
+    for username in offline:
+        batcher.record(username, None)
+    return offline
+
+
+async def is_online(username):
+    return bool(await get_redis().hexists(ONLINE_USERS_KEY, username))
+
+
+def role_key(role):
+    return f"{ROLE_KEY_PREFIX}{role}"
+
+
+async def snapshot():
+    """
+    Online counts per role, the online agents and supervisors, and the diff
+    version they reflect. Customers are left to ``page``.
+    """
+    async with get_redis().pipeline(transaction=True) as pipe:
+        for role in ROLES:
+            pipe.scard(role_key(role))
+        for role in SNAPSHOT_ROLES:
+            pipe.smembers(role_key(role))
+        pipe.get(VERSION_KEY)
+        results = await pipe.execute()
+
+    counts = results[:len(ROLES)]
+    members = results[len(ROLES):-1]
+    return {
+        "version": int(results[-1] or 0),
+        "counts": dict(zip(ROLES, counts)),
+        "users": [
+            {"username": username.decode(), "role": role}
+            for role, usernames in zip(SNAPSHOT_ROLES, members)
+            for username in sorted(usernames)
+        ],
+    }
+
+
+def escape_glob(value):
+    for char in "\\*?[]":
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+async def page(role, cursor=0, count=200, prefix=""):
+    """
+    One SSCAN step over the online users of ``role``, optionally limited to
+    usernames starting with ``prefix``. Returns the next cursor (0 once the
+    scan is complete) and the users found; a page may be empty even when
+    the scan is not done yet.
+    """
+    match = f"{escape_glob(prefix)}*" if prefix else None
+    cursor, usernames = await get_redis().sscan(
+        role_key(role), cursor=cursor, match=match,
+        count=min(count, MAX_PAGE_SIZE))
+    return cursor, [
+        {"username": username.decode(), "role": role}
+        for username in usernames
+    ]
+
+
+class SnapshotCache:
+    """
+    The encoded snapshot frame shared by the supervisors of this worker for
+    PRESENCE_SNAPSHOT_TTL seconds. Supervisors that connect while it is
+    being loaded wait for the same load instead of each querying Redis.
+    A slightly stale snapshot is fine: diffs newer than its version still
+    apply, and a gap makes the client resync.
+    """
+
+    def __init__(self):
+        self.event = None
+        self.expires = 0
+        self.loading = None
+
+    async def get(self):
+        if self.event is not None and time.monotonic() < self.expires:
+            return self.event
+        if self.loading is None:
+            self.loading = asyncio.ensure_future(self.load())
+        # Shielded so one supervisor disconnecting does not cancel the
+        # load the others are waiting on
+        return await asyncio.shield(self.loading)
+
+    async def load(self):
+        try:
+            payload = {"type": "presence.snapshot", **await snapshot()}
+            self.event = frames.event("presence.snapshot", payload)
+            self.expires = time.monotonic() + settings.PRESENCE_SNAPSHOT_TTL
+            return self.event
+        finally:
+            self.loading = None
+
+
+snapshot_cache = SnapshotCache()
+
+
+async def diffs_since(version):
+    """
+    Diff batches published after ``version``, oldest first. Returns None if
+    any of them is no longer (or not yet) available, in which case the
+    caller should send a full snapshot instead.
+    """
+    redis = get_redis()
+    raw = await redis.zrangebyscore(DIFFS_KEY, f"({version}", "+inf")
+    batches = [json.loads(item) for item in raw]
+
+    expected = list(range(version + 1, version + 1 + len(batches)))
+    if [batch["version"] for batch in batches] != expected:
+        return None
+    if not batches and int(await redis.get(VERSION_KEY) or 0) > version:
+        return None
+    return batches
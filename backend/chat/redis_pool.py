@@ -0,0 +1,27 @@
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+
+# asyncio connections are bound to the loop that opened them, so keep one
+# shared pool per running event loop (in practice one per ASGI worker).
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """
+    Return an asyncio Redis client backed by the shared connection pool.
+    Must be called from inside a running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        # Blocking pool: under a connection burst callers wait for a free
+        # connection instead of failing with "Too many connections".
+        pool = aioredis.BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+        )
+        _pools[loop] = pool
+    return aioredis.Redis(connection_pool=pool)
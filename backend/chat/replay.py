@@ -0,0 +1,106 @@
+"""
+Bounded per-conversation replay buffer, so a socket that reconnects only
+gets the events it missed instead of reloading the whole history.
+
+Message, read and delivery frames are appended to the conversation's
+``chat:replay:<id>`` Redis stream, capped at about CHAT_REPLAY_LENGTH
+entries, before they are broadcast, and carry their stream entry id as
+"cursor". A client reconnects with the last cursor it applied and gets
+every later entry replayed. If the cursor entry was already trimmed (or
+the buffer expired), the missed messages are read from the database
+instead.
+"""
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from . import frames
+from .redis_pool import get_redis
+
+STREAM_PREFIX = "chat:replay:"
+CURSOR_RE = re.compile(r"^\d+-\d+$")
+
+
+def stream_key(conversation_id):
+    return f"{STREAM_PREFIX}{conversation_id}"
+
+
+def valid_cursor(cursor):
+    return isinstance(cursor, str) and bool(CURSOR_RE.match(cursor))
+
+
+async def publish(channel_layer, room, handler, payload):
+    """
+    Record the frame in the replay buffer of ``room``, then broadcast it to
+    the room's group tagged with its cursor. Returns the cursor.
+    """
+    key = stream_key(room.conversation_id)
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.xadd(key, {"handler": handler, "payload": frames.encode(payload)},
+                  maxlen=settings.CHAT_REPLAY_LENGTH, approximate=True)
+        pipe.expire(key, settings.CHAT_REPLAY_TTL)
+        entry_id, _ = await pipe.execute()
+
+    cursor = entry_id.decode()
+    await channel_layer.group_send(
+        room.group_name, frames.event(handler, {**payload, "cursor": cursor}))
+    return cursor
+
+
+async def missed_since(conversation_id, cursor):
+    """
+    (handler, payload) of every buffered event after ``cursor``, oldest
+    first. Returns None if the cursor entry is no longer buffered, as later
+    entries may have been trimmed with it.
+    """
+    entries = await get_redis().xrange(stream_key(conversation_id),
+                                       min=cursor, max="+")
+    if not entries or entries[0][0].decode() != cursor:
+        return None
+
+    return [
+        (fields[b"handler"].decode(),
+         {**json.loads(fields[b"payload"]), "cursor": entry_id.decode()})
+        for entry_id, fields in entries[1:]
+    ]
+
+
+def messages_since(conversation_id, cursor):
+    """
+    Database fallback for ``missed_since``: "chat.message" payloads of the
+    messages stored since the cursor was issued, at most
+    CHAT_REPLAY_DB_LIMIT of them. Stream ids are Redis clock milliseconds,
+    so CHAT_REPLAY_CLOCK_SKEW seconds of extra history are included; the
+    client drops messages it already has by id.
+
+    Returns the payloads and whether they are complete.
+    """
+    from .models import Message
+
+    millis = int(cursor.split("-")[0])
+    since = datetime.fromtimestamp(millis / 1000, tz=timezone.utc) - \
+        timedelta(seconds=settings.CHAT_REPLAY_CLOCK_SKEW)
+    limit = settings.CHAT_REPLAY_DB_LIMIT
+
+    rows = list(Message.objects.filter(
+        conversation_id=conversation_id, timestamp__gte=since,
+    ).order_by("seq").values(
+        "id", "seq", "content", "sender__username", "timestamp", "status",
+    )[:limit + 1])
+
+    payloads = [
+        {
+            "type": "message",
+            "conversation": str(conversation_id),
+            "id": str(row["id"]),
+            "seq": row["seq"],
+            "content": row["content"],
+            "sender": row["sender__username"],
+            "timestamp": row["timestamp"].isoformat(),
+            "status": row["status"],
+        }
+        for row in rows[:limit]
+    ]
+    return payloads, len(rows) <= limit
@@ -8,9 +8,10 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ["id", "conversation", "sender",
+        fields = ["id", "seq", "conversation", "sender",
                   "sender_username", "content", "timestamp"]
-        read_only_fields = ["id", "timestamp", "sender", "sender_username"]
+        read_only_fields = ["id", "seq", "timestamp", "sender",
+                            "sender_username"]
 
 
 class MessageSerializer2(serializers.ModelSerializer):
@@ -18,7 +19,7 @@ class MessageSerializer2(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ["id", "sender", "content", "timestamp"]
+        fields = ["id", "seq", "sender", "content", "timestamp"]
 
 
 class ConversationSerializer(serializers.ModelSerializer):
@@ -26,7 +27,6 @@ class ConversationSerializer(serializers.ModelSerializer):
         source="customer.username", read_only=True)
     agent_username = serializers.CharField(
         source="agent.username", read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Conversation
@@ -39,7 +39,6 @@ class ConversationSerializer(serializers.ModelSerializer):
             "status",            # <-- Needs to be read_only
             "created_at",
             "updated_at",
-            "messages",
         ]
         # ADD 'customer', 'agent', and 'status' to read_only_fields
         read_only_fields = [
@@ -49,9 +48,44 @@ class ConversationSerializer(serializers.ModelSerializer):
             "status",
             "created_at",
             "updated_at",
-            "messages"
         ]
 
 
+class ConversationSummarySerializer(serializers.ModelSerializer):
+    """
+    List entry of a conversation without its history; expects a queryset
+    from ``Conversation.objects.with_summary()``.
+    """
+    customer_username = serializers.CharField(
+        source="customer.username", read_only=True)
+    agent_username = serializers.CharField(
+        source="agent.username", read_only=True, default=None)
+    last_message_sender = serializers.CharField(
+        source="last_message_sender.username", read_only=True, default=None)
+    last_message_seq = serializers.IntegerField(source="last_seq",
+                                                read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = [
+            "id",
+            "customer",
+            "customer_username",
+            "agent",
+            "agent_username",
+            "status",
+            "created_at",
+            "updated_at",
+            "last_message_preview",
+            "last_message_sender",
+            "last_message_at",
+            "last_message_seq",
+            "message_count",
+            "unread_count",
+        ]
+        read_only_fields = fields
+
+
 class SimpleDetailSerializer(serializers.Serializer):
     detail = serializers.CharField()
@@ -1,9 +1,8 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django_redis import get_redis_connection
+from . import frames, presence
 
 
-class SupervisorConsumer(AsyncWebsocketConsumer):
+class SupervisorConsumer(frames.FrameConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope["user"]
 
@@ -13,41 +12,65 @@ class SupervisorConsumer(AsyncWebsocketConsumer):
             return
 
         # Join the global presence group
-        await self.channel_layer.group_add("presence_updates",
+        await self.channel_layer.group_add(presence.PRESENCE_GROUP,
                                            self.channel_name)
-        await self.accept()
+        await self.accept_frames()
 
-        # On connect — send current online users
-        redis_conn = get_redis_connection("default")
-        online_users = redis_conn.hgetall("online_users")
-
-        users_list = [
-            {
-                "username": username.decode(),
-                "role": role.decode(),
-            }
-            for username, role in online_users.items()
-        ]
-
-        await self.send(text_data=json.dumps({
-            "type": "presence.snapshot",
-            "users": users_list,
-        }))
+        # On connect — send online counts, agents and supervisors;
+        # customers are requested page by page with "presence.page"
+        await self.send_snapshot()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("presence_updates",
+        await self.channel_layer.group_discard(presence.PRESENCE_GROUP,
                                                self.channel_name)
 
-    # Handle events broadcast from ChatConsumer
-    async def user_online(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "presence.online",
-            "user": event["user"],
-            "role": event["role"]
-        }))
-
-    async def user_offline(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "presence.offline",
-            "user": event["user"]
-        }))
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+
+        # Catch up from the last applied diff version, e.g. after a gap
+        # in versions or a reconnect
+        if data.get("type") == "presence.resync":
+            try:
+                version = int(data.get("version"))
+            except (TypeError, ValueError):
+                version = None
+            batches = None
+            if version is not None:
+                batches = await presence.diffs_since(version)
+            if batches is None:
+                await self.send_snapshot()
+            else:
+                await self.send_payload({"type": "presence.diffs",
+                                         "batches": batches})
+
+        # {"type": "presence.page", "role": "CUSTOMER", "cursor": 0,
+        #  "count": 200, "prefix": "jo"}; continue with the returned cursor
+        # until it is 0
+        elif data.get("type") == "presence.page":
+            role = data.get("role")
+            try:
+                cursor = int(data.get("cursor", 0))
+                count = int(data.get("count", 200))
+            except (TypeError, ValueError):
+                return
+            if role not in presence.ROLES or cursor < 0 or count < 1:
+                return
+            prefix = str(data.get("prefix") or "")
+            cursor, users = await presence.page(role, cursor, count, prefix)
+            await self.send_payload({
+                "type": "presence.page",
+                "role": role,
+                "prefix": prefix,
+                "cursor": cursor,
+                "users": users,
+            })
+
+    async def send_snapshot(self):
+        # Shared with the other supervisors of this worker, see
+        # chat.presence.SnapshotCache
+        await self.presence_snapshot(await presence.snapshot_cache.get())
+
+    # Batched presence changes from chat.presence; frames are encoded once
+    # by the sender, see chat.frames
+    presence_diff = frames.forward_frame
+    presence_snapshot = frames.forward_frame
@@ -1,3 +1,1141 @@
-from django.test import TestCase
+import asyncio
+import inspect
+import io
+import json
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from django_redis import get_redis_connection
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework.test import APIClient
+
+from chat import (
+    frames, inbox, ingest, metrics, participant_cache, presence, replay
+)
+from chat.consumers import (
+    ChatConsumer, ConversationRoom, MultiplexChatConsumer
+)
+from chat.management.commands import persist_messages
+from chat.models import Conversation, Message
+from chat.utils import auto_assign_conversation, least_busy_agent
+
+User = get_user_model()
+
+
+class ChatConsumerPersistenceTests(TransactionTestCase):
+    """
+    Per-message query budget for the websocket message path.
+    TransactionTestCase is used because database_sync_to_async closes
+    connections around every call.
+    """
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username="customer", email="customer@example.com",
+            password="customer123", role=User.Roles.CUSTOMER)
+        self.agent = User.objects.create_user(
+            username="agent", email="agent@example.com",
+            password="agent123", role=User.Roles.AGENT)
+        self.conversation = Conversation.objects.create(
+            customer=self.customer, agent=self.agent,
+            status=Conversation.Status.ASSIGNED)
+
+        self.consumer = ChatConsumer()
+        self.conversation_id = str(self.conversation.id)
+
+    def test_participants_are_loaded_in_one_query(self):
+        with self.assertNumQueries(1):
+            participants = async_to_sync(self.consumer.get_participants)(
+                self.conversation.id)
+
+        self.assertEqual(participants["customer"]["username"], "customer")
+        self.assertEqual(participants["agent"]["email"], "agent@example.com")
+        self.assertTrue(
+            self.consumer.user_can_join(self.agent, participants))
+
+    def test_message_is_saved_with_final_status_and_seq(self):
+        with CaptureQueriesContext(connection) as ctx:
+            msg = async_to_sync(self.consumer.save_message)(
+                self.conversation_id, self.customer, "Hello", "delivered")
+        # One UPDATE ... RETURNING for the sequence number, one INSERT
+        # (SQLite also logs the BEGIN/COMMIT around them)
+        statements = [q["sql"] for q in ctx.captured_queries
+                      if q["sql"] not in ("BEGIN", "COMMIT")]
+        self.assertEqual(len(statements), 2)
+        second = async_to_sync(self.consumer.save_message)(
+            self.conversation_id, self.agent, "Hi", "sent")
+
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, "delivered")
+        self.assertEqual(msg.conversation_id, self.conversation.id)
+        self.assertEqual((msg.seq, second.seq), (1, 2))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_seq, 2)
+        # Counters are kept in the same UPDATE that hands out the seq
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_preview, "Hi")
+        self.assertEqual(self.conversation.last_message_sender_id,
+                         self.agent.id)
+        self.assertEqual((self.conversation.agent_unread_count,
+                          self.conversation.customer_unread_count), (1, 1))
+
+    def test_missing_conversation_cannot_be_joined(self):
+        participants = async_to_sync(self.consumer.get_participants)(
+            "00000000-0000-0000-0000-000000000000")
+
+        self.assertIsNone(participants)
+        self.assertFalse(
+            self.consumer.user_can_join(self.customer, participants))
+
+    def test_read_receipt_marks_all_earlier_messages_in_one_update(self):
+        messages = [
+            Message.objects.create(conversation=self.conversation,
+                                   sender=self.customer, content=str(i))
+            for i in range(20)
+        ]
+        own = Message.objects.create(conversation=self.conversation,
+                                     sender=self.agent, content="mine")
+
+        with self.assertNumQueries(2):
+            advanced = async_to_sync(self.consumer.mark_read_up_to)(
+                self.conversation_id, self.agent, messages[9].seq)
+
+        self.assertTrue(advanced)
+        self.assertEqual(
+            Message.objects.filter(status="read").count(), 10)
+        own.refresh_from_db()
+        self.assertEqual(own.status, "sent")
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.agent_last_read_seq,
+                         messages[9].seq)
+        self.assertEqual(self.conversation.agent_unread_count, 10)
+        self.assertEqual(self.conversation.customer_unread_count, 1)
+
+        # An older receipt neither rewinds the watermark nor re-broadcasts
+        self.assertFalse(async_to_sync(self.consumer.mark_read_up_to)(
+            self.conversation_id, self.agent, messages[3].seq))
+
+    def test_read_receipt_follows_seq_not_timestamps(self):
+        first = Message.objects.create(conversation=self.conversation,
+                                       sender=self.customer, content="1")
+        # Same timestamp, and one stamped earlier by a skewed clock
+        same = Message.objects.create(conversation=self.conversation,
+                                      sender=self.customer, content="2",
+                                      timestamp=first.timestamp)
+        skewed = Message.objects.create(
+            conversation=self.conversation, sender=self.customer,
+            content="3", timestamp=first.timestamp - timedelta(seconds=5))
+
+        async_to_sync(self.consumer.mark_read_up_to)(
+            self.conversation_id, self.agent, first.seq)
+
+        self.assertEqual(
+            list(Message.objects.filter(status="read").values_list(
+                "id", flat=True)), [first.id])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.agent_last_read_seq, first.seq)
+        self.assertEqual(self.conversation.agent_unread_count, 2)
+        self.assertEqual({same.seq, skewed.seq}, {2, 3})
+
+    def test_pending_messages_are_delivered_in_one_update(self):
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation,
+                                   sender=self.agent, content=str(i))
+
+        with self.assertNumQueries(1):
+            delivered = async_to_sync(self.consumer.mark_delivered)(
+                self.conversation_id, self.customer)
+
+        self.assertEqual(delivered, 5)
+
+    def test_retried_client_id_is_not_stored_twice(self):
+        first = async_to_sync(self.consumer.save_message)(
+            self.conversation_id, self.customer, "Hello", "sent", "client-1")
+
+        # Same client id from a fresh connection (e.g. after a reconnect)
+        retry = async_to_sync(ChatConsumer().save_message)(
+            self.conversation_id, self.customer, "Hello", "sent", "client-1")
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(retry)
+        self.assertEqual(Message.objects.count(), 1)
+        # The rejected retry gave its sequence number back
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_seq, 1)
+
+    @override_settings(CLIENT_ID_CACHE_SIZE=2)
+    def test_client_id_cache_is_bounded(self):
+        self.consumer.init_socket()
+        room = ConversationRoom(self.conversation_id, None)
+        for client_id in ["a", "b", "c"]:
+            self.assertFalse(self.consumer.seen_client_id(room, client_id))
+
+        self.assertEqual(len(self.consumer.client_ids), 2)
+        self.assertFalse(self.consumer.seen_client_id(room, "a"))
+        self.assertTrue(self.consumer.seen_client_id(room, "c"))
+
+
+class MultiplexChatConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username="customer", password="customer123",
+            role=User.Roles.CUSTOMER)
+        self.agent = User.objects.create_user(
+            username="agent", password="agent123", role=User.Roles.AGENT)
+        self.assigned = Conversation.objects.create(
+            customer=self.customer, agent=self.agent,
+            status=Conversation.Status.ASSIGNED)
+        self.unassigned = Conversation.objects.create(customer=self.customer)
+
+        self.consumer = MultiplexChatConsumer()
+        self.consumer.scope = {"user": self.agent}
+        self.consumer.channel_name = "agent-socket"
+        self.consumer.channel_layer = mock.AsyncMock()
+        self.consumer.send = mock.AsyncMock()
+        self.consumer.init_socket()
+        self.consumer.rooms = {}
+
+    def sent_frames(self):
+        return [json.loads(call.kwargs["text_data"])
+                for call in self.consumer.send.call_args_list]
+
+    def receive(self, payload):
+        async_to_sync(self.consumer.receive)(text_data=json.dumps(payload))
+
+    def test_subscriptions_are_authorized_from_the_participant_cache(self):
+        other = MultiplexChatConsumer()
+        other.channel_name = "other-socket"
+        other.channel_layer = mock.AsyncMock()
+        # Cached while still unassigned
+        async_to_sync(other.get_participants)(self.unassigned.id)
+
+        Conversation.objects.filter(id=self.unassigned.id).update(
+            agent=self.agent, status=Conversation.Status.ASSIGNED)
+        # The stale entry is re-checked against the database, not trusted
+        self.receive({"type": "subscribe",
+                      "conversation": str(self.unassigned.id)})
+        self.assertIn(str(self.unassigned.id), self.consumer.rooms)
+
+        # ...which refreshed it: the next handshake needs no query
+        with self.assertNumQueries(0):
+            room = async_to_sync(other.join_room)(self.agent,
+                                                  self.unassigned.id)
+        self.assertIsNotNone(room)
+
+        Conversation.objects.filter(id=self.unassigned.id).update(
+            status=Conversation.Status.CLOSED)
+        participant_cache.invalidate(self.unassigned.id)
+        participants = async_to_sync(other.get_participants)(
+            self.unassigned.id)
+        self.assertEqual(participants["status"], "CLOSED")
+
+    def test_subscribe_only_to_authorized_conversations(self):
+        self.receive({"type": "subscribe",
+                      "conversation": str(self.assigned.id)})
+        self.receive({"type": "subscribe",
+                      "conversation": str(self.unassigned.id)})
+        self.receive({"type": "subscribe", "conversation": "not-a-uuid"})
+
+        self.assertEqual(list(self.consumer.rooms), [str(self.assigned.id)])
+        self.assertEqual([frame["type"] for frame in self.sent_frames()],
+                         ["subscribed", "error", "error"])
+        self.consumer.channel_layer.group_add.assert_called_once_with(
+            f"conversation_{self.assigned.id}", "agent-socket")
+
+    def test_conversation_ids_are_normalized(self):
+        upper = str(self.assigned.id).upper()
+        self.receive({"type": "subscribe", "conversation": upper})
+        self.receive({"type": "typing.start", "conversation": upper})
+
+        self.assertEqual(list(self.consumer.rooms), [str(self.assigned.id)])
+        self.consumer.channel_layer.group_add.assert_called_once_with(
+            f"conversation_{self.assigned.id}", "agent-socket")
+        self.assertEqual(
+            self.consumer.channel_layer.group_send.call_args.args[0],
+            f"conversation_{self.assigned.id}")
+        self.assertEqual(self.sent_frames()[0]["conversation"],
+                         str(self.assigned.id))
+
+    def test_events_are_routed_and_tagged_by_conversation(self):
+        self.receive({"type": "subscribe",
+                      "conversation": str(self.assigned.id)})
+        self.receive({"type": "typing.start",
+                      "conversation": str(self.assigned.id)})
+        self.receive({"type": "typing.start",
+                      "conversation": str(self.unassigned.id)})
+
+        group, event = self.consumer.channel_layer.group_send.call_args.args
+        self.assertEqual(group, f"conversation_{self.assigned.id}")
+        self.assertEqual(json.loads(event["text"])["conversation"],
+                         str(self.assigned.id))
+        self.assertEqual(self.sent_frames()[-1]["detail"], "Not subscribed")
+
+    def test_resubscribe_with_cursor_replays_only_missed_events(self):
+        conversation_id = str(self.assigned.id)
+        self.receive({"type": "subscribe", "conversation": conversation_id})
+        room = self.consumer.rooms[conversation_id]
+        cursors = [
+            async_to_sync(replay.publish)(
+                self.consumer.channel_layer, room, "chat.read",
+                {"type": "message.read", "conversation": conversation_id,
+                 "id": str(i), "reader": "customer"})
+            for i in range(3)
+        ]
+        self.receive({"type": "unsubscribe", "conversation": conversation_id})
+        self.consumer.send.reset_mock()
+
+        self.receive({"type": "subscribe", "conversation": conversation_id,
+                      "cursor": cursors[0]})
+
+        frames_sent = self.sent_frames()
+        self.assertEqual([frame.get("cursor") for frame in frames_sent[1:3]],
+                         cursors[1:])
+        self.assertEqual(frames_sent[-1], {"type": "replay.done",
+                                           "conversation": conversation_id,
+                                           "complete": True})
+
+    def test_trimmed_cursor_falls_back_to_the_database(self):
+        conversation_id = str(self.assigned.id)
+        message = Message.objects.create(conversation=self.assigned,
+                                         sender=self.customer, content="Hi")
+
+        # A cursor the buffer no longer has, issued just before the message
+        millis = int(message.timestamp.timestamp() * 1000)
+        self.receive({"type": "subscribe", "conversation": conversation_id,
+                      "cursor": f"{millis}-0"})
+
+        frames_sent = self.sent_frames()
+        self.assertEqual([frame["type"] for frame in frames_sent],
+                         ["subscribed", "message", "replay.done"])
+        self.assertEqual(frames_sent[1]["id"], str(message.id))
+        self.assertTrue(frames_sent[2]["complete"])
+
+
+class AgentInboxTests(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username="customer", password="customer123",
+            role=User.Roles.CUSTOMER)
+        self.agent = User.objects.create_user(
+            username="agent", password="agent123", role=User.Roles.AGENT)
+        self.client = APIClient()
+
+    def test_snapshot_is_one_query_without_history(self):
+        other = User.objects.create_user(
+            username="other", password="agent123", role=User.Roles.AGENT)
+        open_convo = Conversation.objects.create(customer=self.customer)
+        Message.objects.create(conversation=open_convo,
+                               sender=self.customer, content="Hi")
+        Conversation.objects.create(customer=self.customer, agent=other,
+                                    status=Conversation.Status.ASSIGNED)
+        open_convo.refresh_from_db()  # the message bumped updated_at
+
+        with self.assertNumQueries(1):
+            rows = inbox.snapshot(self.agent)
+
+        self.assertEqual(rows, [{
+            "id": str(open_convo.id),
+            "status": "OPEN",
+            "customer": "customer",
+            "updated_at": open_convo.updated_at.isoformat(),
+        }])
+
+    @mock.patch("chat.inbox.publish")
+    def test_views_publish_inbox_deltas(self, publish):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post(reverse("conversation-create"), {})
+        conversation_id = response.data["id"]
+
+        self.client.force_authenticate(self.agent)
+        self.client.post(reverse("accept-conversation",
+                                 args=[conversation_id]))
+        self.client.post(reverse("close-conversation",
+                                 args=[conversation_id]))
+
+        self.assertEqual(
+            [(call.args[0], call.args[1]) for call in publish.call_args_list],
+            [(inbox.INBOX_GROUP, "conversation.opened"),
+             (inbox.INBOX_GROUP, "conversation.assigned"),
+             (inbox.agent_group(self.agent.id), "conversation.closed")])
+
+    @mock.patch("chat.utils.online_agent_usernames")
+    def test_auto_assign_picks_the_least_busy_online_agent(self, online):
+        busy = User.objects.create_user(
+            username="busy", password="agent123", role=User.Roles.AGENT)
+        offline = User.objects.create_user(
+            username="offline", password="agent123", role=User.Roles.AGENT)
+        Conversation.objects.create(customer=self.customer, agent=busy,
+                                    status=Conversation.Status.ASSIGNED)
+        # Closed conversations are no load
+        for _ in range(3):
+            Conversation.objects.create(customer=self.customer,
+                                        agent=self.agent,
+                                        status=Conversation.Status.CLOSED)
+        conversation = Conversation.objects.create(customer=self.customer)
+
+        online.return_value = []
+        self.assertIsNone(auto_assign_conversation(conversation))
+
+        online.return_value = ["busy", "agent"]
+        with self.assertNumQueries(1):
+            self.assertEqual(least_busy_agent(online.return_value),
+                             self.agent)
+        self.assertEqual(auto_assign_conversation(conversation), self.agent)
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.agent, conversation.status),
+                         (self.agent, Conversation.Status.ASSIGNED))
+        self.assertNotEqual(offline, conversation.agent)
+
+        # Tied on one ASSIGNED conversation each: by username
+        second = Conversation.objects.create(customer=self.customer)
+        self.assertEqual(auto_assign_conversation(second), self.agent)
+
+
+class ConversationMessagesViewTests(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username="customer", password="customer123",
+            role=User.Roles.CUSTOMER)
+        self.conversation = Conversation.objects.create(
+            customer=self.customer)
+        for i in range(1, 121):
+            Message.objects.create(conversation=self.conversation,
+                                   sender=self.customer, content=str(i))
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.url = reverse("get_conversation_messages",
+                           args=[self.conversation.id])
+
+    def seqs(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [message["seq"] for message in response.data]
+
+    @override_settings(MESSAGES_PAGE_SIZE=50)
+    def test_newest_page_is_loaded_in_one_query(self):
+        # Plus the conversation lookup for the validators
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        self.assertEqual([m["seq"] for m in response.data],
+                         list(range(71, 121)))
+        self.assertEqual(response.data[0]["sender"], "customer")
+
+    def test_keyset_pages(self):
+        self.assertEqual(self.seqs(before=71, limit=20), list(range(51, 71)))
+        self.assertEqual(self.seqs(after=115), list(range(116, 121)))
+        self.assertEqual(self.seqs(after=10, before=14), [11, 12, 13])
+
+    @override_settings(MESSAGES_MAX_PAGE_SIZE=30)
+    def test_page_size_is_capped(self):
+        self.assertEqual(len(self.seqs(limit=1000)), 30)
+
+    def test_unchanged_page_is_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Another page, or a new message, has a different validator
+        response = self.client.get(self.url, {"before": 10},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        Message.objects.create(conversation=self.conversation,
+                               sender=self.customer, content="new")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[-1]["content"], "new")
+
+    def test_messages_stored_in_the_same_second_are_not_hidden(self):
+        etag = self.client.get(self.url)["ETag"]
+        last = Message.objects.filter(
+            conversation=self.conversation).latest("seq")
+        Message.objects.create(conversation=self.conversation,
+                               sender=self.customer, content="same second",
+                               timestamp=last.timestamp)
+
+        # If-Modified-Since is ignored: only the ETag can give a 304
+        for headers in [{"HTTP_IF_NONE_MATCH": etag},
+                        {"HTTP_IF_MODIFIED_SINCE": http_date(time.time())}]:
+            response = self.client.get(self.url, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data[-1]["content"], "same second")
+            self.assertNotIn("Last-Modified", response)
+
+    def test_invalid_cursor_is_rejected(self):
+        for params in [{"before": "x"}, {"limit": 0}, {"since": "yesterday"}]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+
+class ConversationSummaryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.agent = User.objects.create_user(
+            username="agent", password="agent123", role=User.Roles.AGENT)
+        self.supervisor = User.objects.create_user(
+            username="supervisor", password="supervisor123",
+            role=User.Roles.SUPERVISOR)
+        self.client = APIClient()
+
+        for i in range(5):
+            customer = User.objects.create_user(
+                username=f"customer{i}", password="customer123",
+                role=User.Roles.CUSTOMER)
+            conversation = Conversation.objects.create(
+                customer=customer, agent=self.agent,
+                status=Conversation.Status.ASSIGNED)
+            for j in range(3):
+                Message.objects.create(conversation=conversation,
+                                       sender=customer, content=f"ask {j}")
+            Message.objects.create(conversation=conversation,
+                                   sender=self.agent, content="answer" * 50,
+                                   status="read")
+
+    def test_lists_are_one_query_regardless_of_size(self):
+        # One aggregate for the validators, one for the list
+        self.client.force_authenticate(self.supervisor)
+        with self.assertNumQueries(2):
+            supervisor_list = self.client.get(
+                reverse("supervisor-conversations")).data
+
+        self.client.force_authenticate(self.agent)
+        with self.assertNumQueries(2):
+            agent_list = self.client.get(
+                reverse("agent-conversations")).data
+
+        self.assertEqual(len(supervisor_list), 5)
+        summary = agent_list[0]
+        self.assertNotIn("messages", summary)
+        self.assertEqual(summary["agent_username"], "agent")
+        self.assertEqual(summary["last_message_sender"], "agent")
+        self.assertEqual(summary["last_message_seq"], 4)
+        self.assertEqual(len(summary["last_message_preview"]),
+                         inbox.PREVIEW_LENGTH)
+        self.assertEqual(summary["unread_count"], 3)
+
+    def test_unchanged_lists_are_not_modified(self):
+        url = reverse("supervisor-conversations")
+        self.client.force_authenticate(self.supervisor)
+        etag = self.client.get(url)["ETag"]
+
+        # Answered from the list cache
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # The validators are per list
+        self.client.force_authenticate(self.agent)
+        response = self.client.get(reverse("agent-conversations"),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # A new message bumps its conversation's updated_at
+        conversation = Conversation.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=conversation,
+                                   sender=conversation.customer,
+                                   content="more")
+        self.client.force_authenticate(self.supervisor)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_conversation_leaving_a_list_changes_its_etag(self):
+        url = reverse("supervisor-conversations")
+        self.client.force_authenticate(self.supervisor)
+        etag = self.client.get(url)["ETag"]
+
+        # Not the newest: the latest updated_at of the rest doesn't move
+        oldest = Conversation.objects.order_by("updated_at").first()
+        self.client.force_authenticate(self.agent)
+        self.client.post(reverse("close-conversation", args=[oldest.id]))
+
+        self.client.force_authenticate(self.supervisor)
+        for headers in [{"HTTP_IF_NONE_MATCH": etag},
+                        {"HTTP_IF_MODIFIED_SINCE": http_date(time.time())}]:
+            # Also without the list cache's invalidation
+            cache.clear()
+            response = self.client.get(url, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), 4)
+
+    def test_lists_are_cached_until_a_conversation_changes(self):
+        supervisor_url = reverse("supervisor-conversations")
+        agent_url = reverse("agent-conversations")
+        other_agent = User.objects.create_user(
+            username="other", password="agent123", role=User.Roles.AGENT)
+        customer = User.objects.get(username="customer0")
+
+        def fetch(user, url, queries):
+            self.client.force_authenticate(user)
+            with self.assertNumQueries(queries):
+                return self.client.get(url).data
+
+        before = metrics.snapshot()
+        fetch(self.supervisor, supervisor_url, 2)
+        fetch(self.supervisor, supervisor_url, 0)
+        fetch(self.agent, agent_url, 2)
+        fetch(other_agent, agent_url, 2)
+        fetch(other_agent, agent_url, 0)
+        after = metrics.snapshot()
+        self.assertEqual(after["list_cache.hit"] -
+                         before.get("list_cache.hit", 0), 2)
+        self.assertEqual(after["list_cache.miss"] -
+                         before.get("list_cache.miss", 0), 3)
+
+        # A new open conversation shows up for everyone
+        conversation = Conversation.objects.get(customer=customer)
+        conversation.status = Conversation.Status.CLOSED
+        conversation.save()
+        self.client.force_authenticate(customer)
+        opened = self.client.post(reverse("conversation-create"), {}).data
+        self.assertEqual(len(fetch(self.supervisor, supervisor_url, 2)), 5)
+        self.assertEqual(len(fetch(other_agent, agent_url, 2)), 1)
+
+        # Accepting it moves it out of the other agents' queue
+        self.client.force_authenticate(self.agent)
+        self.client.post(reverse("accept-conversation", args=[opened["id"]]))
+        self.assertEqual(len(fetch(other_agent, agent_url, 2)), 0)
+        self.assertEqual(len(fetch(self.agent, agent_url, 2)), 5)
+
+        # A message changes the preview of its agent's list only
+        accepted = Conversation.objects.get(id=opened["id"])
+        fetch(other_agent, agent_url, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=accepted, sender=customer,
+                                   content="hello")
+        fetch(other_agent, agent_url, 0)
+        summaries = fetch(self.agent, agent_url, 2)
+        self.assertEqual(summaries[0]["last_message_preview"], "hello")
+
+        # Closing it removes it from the supervisor list
+        self.client.force_authenticate(self.agent)
+        self.client.post(reverse("close-conversation", args=[opened["id"]]))
+        self.assertEqual(len(fetch(self.supervisor, supervisor_url, 2)), 4)
+
+    def test_customer_unread_counts_messages_from_the_agent(self):
+        customer = User.objects.get(username="customer0")
+        self.client.force_authenticate(customer)
+
+        with self.assertNumQueries(1):
+            conversations = self.client.get(
+                reverse("conversation-create")).data
+
+        self.assertEqual(len(conversations), 1)
+        self.assertEqual(conversations[0]["unread_count"], 0)
+
+
+@skipUnless(connection.vendor in ("postgresql", "sqlite"),
+            "query plans are only checked on PostgreSQL and SQLite")
+class QueryPlanTests(TestCase):
+    """
+    The hot queries must keep using indexes on a realistic volume: mostly
+    closed conversations with some history each. Every query a view or
+    consumer helper runs on the chat tables is EXPLAINed and must not scan
+    a whole table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agents = User.objects.bulk_create([
+            User(username=f"agent{i}", role=User.Roles.AGENT)
+            for i in range(20)
+        ])
+        cls.customers = User.objects.bulk_create([
+            User(username=f"customer{i}", role=User.Roles.CUSTOMER)
+            for i in range(1000)
+        ])
+        cls.supervisor = User.objects.create_user(
+            username="supervisor", role=User.Roles.SUPERVISOR)
+
+        statuses = (["CLOSED"] * 8) + ["ASSIGNED", "OPEN"]
+        conversations = Conversation.objects.bulk_create([
+            Conversation(
+                customer=cls.customers[i % len(cls.customers)],
+                agent=(None if statuses[i % 10] == "OPEN"
+                       else cls.agents[i % len(cls.agents)]),
+                status=statuses[i % 10],
+                last_seq=10,
+            )
+            for i in range(3000)
+        ])
+        Message.objects.bulk_create([
+            Message(conversation=conversation, seq=seq,
+                    sender=conversation.customer, content=f"message {seq}",
+                    status="sent" if seq == 10 else "read")
+            for conversation in conversations
+            for seq in range(1, 11)
+        ], batch_size=5000)
+
+        cls.conversation = next(c for c in conversations
+                                if c.status == "ASSIGNED")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"EXPLAIN {sql}")
+                return [row[0] for row in cursor.fetchall()
+                        if "Seq Scan on chat_" in row[0]]
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[3] for row in cursor.fetchall()
+                    if row[3].startswith("SCAN chat_") and
+                    "USING" not in row[3]]
+
+    def assertUsesIndexes(self, run):
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        queries = [q["sql"] for q in ctx.captured_queries
+                   if "chat_" in q["sql"]]
+        self.assertTrue(queries)
+        for sql in queries:
+            self.assertEqual(self.full_scans(sql), [], sql)
+
+    def test_message_pages(self):
+        url = reverse("get_conversation_messages",
+                      args=[self.conversation.id])
+        self.client.force_authenticate(self.conversation.customer)
+        for params in [{}, {"before": 5}, {"after": 5},
+                       {"since": "2025-01-01T00:00:00Z"}]:
+            self.assertUsesIndexes(lambda: self.client.get(url, params))
+
+    def test_conversation_lists(self):
+        self.client.force_authenticate(self.conversation.customer)
+        self.assertUsesIndexes(
+            lambda: self.client.get(reverse("conversation-create")))
+
+        self.client.force_authenticate(self.conversation.agent)
+        self.assertUsesIndexes(
+            lambda: self.client.get(reverse("agent-conversations")))
+        self.assertUsesIndexes(
+            lambda: inbox.snapshot(self.conversation.agent))
+
+        self.client.force_authenticate(self.supervisor)
+        self.assertUsesIndexes(
+            lambda: self.client.get(reverse("supervisor-conversations")))
+
+    def test_agent_load_reads_only_assigned_conversations(self):
+        # The status is part of the join, so the (agent, status) index range
+        # leaves out the closed history
+        with CaptureQueriesContext(connection) as ctx:
+            least_busy_agent([agent.username for agent in self.agents])
+        sql = ctx.captured_queries[-1]["sql"]
+
+        self.assertEqual(self.full_scans(sql), [])
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"EXPLAIN {sql}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                self.assertRegex(plan, r"Index Cond: .*status")
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = "\n".join(row[3] for row in cursor.fetchall())
+                self.assertIn("conversation_agent_status "
+                              "(agent_id=? AND status=?)", plan)
+
+    def test_consumer_receipts(self):
+        consumer = ChatConsumer()
+        conversation_id = self.conversation.id
+        last = Message.objects.get(conversation=self.conversation, seq=10)
+
+        # The undecorated functions, on this test's connection
+        def sync(name):
+            return inspect.getattr_static(ChatConsumer, name).func
+
+        self.assertUsesIndexes(lambda: sync("mark_delivered")(
+            consumer, conversation_id, self.conversation.agent))
+        self.assertUsesIndexes(lambda: sync("mark_read_up_to")(
+            consumer, conversation_id, self.conversation.agent, last.seq))
+        self.assertUsesIndexes(lambda: replay.messages_since(
+            conversation_id, "1735689600000-0"))
+
+
+class TypingThrottleTests(SimpleTestCase):
+
+    def setUp(self):
+        self.user = User(username="customer", role=User.Roles.CUSTOMER)
+        self.room = ConversationRoom(uuid.uuid4(), None)
+        self.consumer = ChatConsumer()
+        self.consumer.channel_layer = mock.AsyncMock()
+
+    def sent_frame_types(self):
+        return [json.loads(call.args[1]["text"])["type"] for call in
+                self.consumer.channel_layer.group_send.call_args_list]
+
+    def test_only_transitions_are_forwarded(self):
+        suppressed = metrics.counters["typing.suppressed"]
+
+        async def keystrokes():
+            for _ in range(5):
+                await self.consumer.handle_typing(self.user, self.room, True)
+            await self.consumer.handle_typing(self.user, self.room, False)
+            await self.consumer.handle_typing(self.user, self.room, False)
+
+        async_to_sync(keystrokes)()
+
+        events = self.sent_frame_types()
+        self.assertEqual(events, ["typing.start", "typing.stop"])
+        self.assertEqual(metrics.counters["typing.suppressed"],
+                         suppressed + 5)
+
+    @override_settings(TYPING_TIMEOUT=0)
+    def test_start_without_stop_expires(self):
+        async def start_and_wait():
+            await self.consumer.handle_typing(self.user, self.room, True)
+            await asyncio.sleep(0.01)
+
+        async_to_sync(start_and_wait)()
+
+        events = self.sent_frame_types()
+        self.assertEqual(events, ["typing.start", "typing.stop"])
+        self.assertFalse(self.room.is_typing)
+
+
+class PresenceDiffBatchTests(SimpleTestCase):
+
+    @mock.patch("chat.presence.get_channel_layer")
+    @mock.patch("chat.presence.get_redis")
+    def test_changes_in_one_window_are_published_as_one_diff(
+            self, get_redis, get_channel_layer):
+        redis = get_redis.return_value
+        pipe = redis.pipeline.return_value.__aenter__.return_value
+        # The version, the users' roles and the per-role counts, then the
+        # history write
+        pipe.execute = mock.AsyncMock(
+            side_effect=[[7, [None, b"CUSTOMER"], 1, 0, 1], []])
+        channel_layer = get_channel_layer.return_value
+        channel_layer.group_send = mock.AsyncMock()
+
+        batcher = presence.DiffBatcher()
+        batcher.flush_task = mock.Mock()  # keep the timer out of the test
+        batcher.record("agent", "AGENT")
+        batcher.record("customer", "CUSTOMER")
+        batcher.record("agent", None)
+        async_to_sync(batcher.flush)()
+
+        channel_layer.group_send.assert_called_once()
+        group, event = channel_layer.group_send.call_args.args
+        self.assertEqual(group, presence.PRESENCE_GROUP)
+        self.assertEqual(json.loads(event["text"]), {
+            "type": "presence.diff",
+            "version": 7,
+            "counts": {"AGENT": 1, "SUPERVISOR": 0, "CUSTOMER": 1},
+            "online": [{"username": "customer", "role": "CUSTOMER"}],
+            "offline": ["agent"],
+        })
+        self.assertEqual(batcher.pending, {})
+
+    @mock.patch("chat.presence.get_channel_layer")
+    @mock.patch("chat.presence.get_redis")
+    def test_diff_carries_the_current_state_not_the_buffered_change(
+            self, get_redis, get_channel_layer):
+        pipe = get_redis.return_value.pipeline.return_value \
+            .__aenter__.return_value
+        # Back online on another worker before this one flushed
+        pipe.execute = mock.AsyncMock(
+            side_effect=[[8, [b"AGENT"], 1, 0, 0], []])
+        get_channel_layer.return_value.group_send = mock.AsyncMock()
+
+        batcher = presence.DiffBatcher()
+        batcher.flush_task = mock.Mock()
+        batcher.record("agent", None)
+        async_to_sync(batcher.flush)()
+
+        pipe.hmget.assert_called_once_with(presence.ONLINE_USERS_KEY,
+                                           ["agent"])
+        _, event = get_channel_layer.return_value.group_send.call_args.args
+        diff = json.loads(event["text"])
+        self.assertEqual(diff["online"],
+                         [{"username": "agent", "role": "AGENT"}])
+        self.assertEqual(diff["offline"], [])
+
+    @mock.patch("chat.presence.get_redis")
+    def test_only_first_and_last_connection_change_presence(self, get_redis):
+        script = mock.AsyncMock()
+        get_redis.return_value.register_script.return_value = script
+        batcher = presence.DiffBatcher()
+        batcher.flush_task = mock.Mock()
+        keeper = presence.LeaseKeeper()
+        keeper.heartbeat_task = mock.Mock()
+
+        async def two_tabs():
+            # Connection counts as returned by the lease scripts
+            script.side_effect = [1, 2]
+            await presence.mark_online("agent", "AGENT", "tab-1")
+            await presence.mark_online("agent", "AGENT", "tab-2")
+            batcher.pending.clear()
+            script.side_effect = [1, 0]
+            await presence.mark_offline("agent", "tab-1")
+            self.assertEqual(batcher.pending, {})
+            await presence.mark_offline("agent", "tab-2")
+
+        with mock.patch.multiple(presence, batcher=batcher, keeper=keeper):
+            async_to_sync(two_tabs)()
+
+        self.assertEqual(batcher.pending, {"agent": None})
+        self.assertEqual(keeper.leases, {})
+
+    @override_settings(PRESENCE_HEARTBEAT_INTERVAL=0)
+    @mock.patch("chat.presence.get_redis")
+    def test_heartbeat_survives_a_failed_renewal(self, get_redis):
+        batcher = presence.DiffBatcher()
+        batcher.flush_task = mock.Mock()
+        keeper = presence.LeaseKeeper()
+        keeper.leases = {"tab-1|agent": ("agent", "AGENT")}
+        calls = []
+
+        async def run_script(keys, args):
+            calls.append(keys)
+            if len(calls) == 1:
+                raise RedisConnectionError("Connection reset by peer")
+            if len(calls) == 2:
+                # Swept while renewals were failing
+                return [b"tab-1|agent"]
+            if len(calls) == 3:
+                return 1  # re-acquired: the first connection again
+            keeper.leases.clear()
+            return []
+
+        get_redis.return_value.register_script.return_value = mock.AsyncMock(
+            side_effect=run_script)
+        with mock.patch.object(presence, "batcher", batcher), \
+                self.assertLogs("chat.presence", "ERROR"):
+            async_to_sync(keeper.heartbeat)()
+
+        self.assertEqual(calls[2], presence.PRESENCE_KEYS)
+        self.assertEqual(batcher.pending, {"agent": "AGENT"})
+        self.assertIsNone(keeper.heartbeat_task)
+
+    @mock.patch("chat.presence.snapshot")
+    def test_concurrent_supervisors_share_one_snapshot_load(self, snapshot):
+        snapshot.return_value = {
+            "version": 3,
+            "counts": {"AGENT": 1, "SUPERVISOR": 0, "CUSTOMER": 5000},
+            "users": [{"username": "agent", "role": "AGENT"}],
+        }
+        cache = presence.SnapshotCache()
+
+        async def connect_three():
+            return await asyncio.gather(*(cache.get() for _ in range(3)))
+
+        events = async_to_sync(connect_three)()
+
+        snapshot.assert_called_once()
+        self.assertTrue(all(event is events[0] for event in events))
+        self.assertEqual(json.loads(events[0]["text"])["counts"]["CUSTOMER"],
+                         5000)
+        self.assertIsNone(cache.loading)
+
+
+class FrameEncodingTests(SimpleTestCase):
+
+    payload = {"type": "message", "id": "42", "content": "Hello",
+               "sender": "customer", "status": "sent"}
+
+    def test_msgpack_frame_uses_compact_keys_and_round_trips(self):
+        event = frames.event("chat.message", self.payload)
+        binary = frames.encode_binary(self.payload)
+
+        # The channel layer only carries the JSON frame
+        self.assertEqual(set(event), {"type", "text"})
+        self.assertEqual(json.loads(event["text"]), self.payload)
+        self.assertLess(len(binary), len(event["text"]))
+        self.assertIn("t", msgpack.unpackb(binary))
+        self.assertEqual(frames.decode_binary(binary), self.payload)
+
+    def test_forward_frame_matches_negotiated_format(self):
+        event = frames.event("chat.message", self.payload)
+        consumer = ChatConsumer()
+        consumer.send = mock.AsyncMock()
+
+        async_to_sync(consumer.chat_message)(event)
+        consumer.binary_frames = True
+        async_to_sync(consumer.chat_message)(event)
+
+        consumer.send.assert_has_calls([
+            mock.call(text_data=event["text"]),
+            mock.call(bytes_data=frames.encode_binary(self.payload)),
+        ])
+
+
+class PersistMessagesCommandTests(TransactionTestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username="customer", password="customer123",
+            role=User.Roles.CUSTOMER)
+        self.conversation = Conversation.objects.create(
+            customer=self.customer)
+
+    def make_entry(self, msg_id, content):
+        return (f"{msg_id}-0".encode(), {
+            b"id": str(uuid.uuid4()).encode(),
+            b"conversation_id": str(self.conversation.id).encode(),
+            b"sender_id": str(self.customer.id).encode(),
+            b"content": content.encode(),
+            b"status": b"delivered",
+            b"timestamp": b"2025-11-13T15:44:00+00:00",
+            b"seq": str(msg_id).encode(),
+        })
+
+    def test_batch_is_written_once_and_acknowledged_after_commit(self):
+        redis_conn = mock.Mock()
+        items = [self.make_entry(1, "Hello"), self.make_entry(2, "Anyone?")]
+        command = persist_messages.Command()
+
+        self.assertEqual(command.persist(redis_conn, "chat:ingest:0", items),
+                         2)
+        # A redelivered batch is skipped on the pre-assigned primary keys
+        command.persist(redis_conn, "chat:ingest:0", items)
+
+        self.assertEqual(Message.objects.count(), 2)
+        msg = Message.objects.get(content="Hello")
+        self.assertEqual(msg.status, "delivered")
+        self.assertEqual(msg.timestamp.isoformat(),
+                         "2025-11-13T15:44:00+00:00")
+        redis_conn.xack.assert_called_with(
+            "chat:ingest:0", ingest.CONSUMER_GROUP, b"1-0", b"2-0")
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_seq, 2)
+        # The redelivery did not count the messages twice
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.agent_unread_count, 2)
+        self.assertEqual(self.conversation.last_message_preview, "Anyone?")
+
+    def test_entries_that_cannot_be_stored_are_dead_lettered(self):
+        redis_conn = mock.MagicMock()
+        deleted = Conversation.objects.create(customer=self.customer)
+        orphan = self.make_entry(2, "Lost")
+        orphan[1][b"conversation_id"] = str(deleted.id).encode()
+        deleted.delete()
+        garbled = (b"3-0", {b"id": b"not-a-uuid"})
+        items = [self.make_entry(1, "Hello"), orphan, garbled,
+                 self.make_entry(4, "rejected"), self.make_entry(5, "Bye")]
+
+        bulk_create = Message.objects.bulk_create
+
+        def fail_on_rejected(messages, **kwargs):
+            if any(m.content == "rejected" for m in messages):
+                raise IntegrityError("rejected")
+            return bulk_create(messages, **kwargs)
+
+        command = persist_messages.Command(stderr=io.StringIO())
+        with mock.patch.object(Message.objects, "bulk_create",
+                               side_effect=fail_on_rejected):
+            written = command.persist(redis_conn, "chat:ingest:0", items)
+
+        self.assertEqual(written, 2)
+        self.assertEqual(
+            list(Message.objects.order_by("seq").values_list(
+                "content", flat=True)), ["Hello", "Bye"])
+        pipe = redis_conn.pipeline.return_value.__enter__.return_value
+        self.assertEqual(
+            [(call.args[0], call.args[1]["entry_id"])
+             for call in pipe.xadd.call_args_list],
+            [(ingest.DEAD_LETTER_KEY, b"3-0"),
+             (ingest.DEAD_LETTER_KEY, b"2-0"),
+             (ingest.DEAD_LETTER_KEY, b"4-0")])
+        self.assertEqual(pipe.xadd.call_args_list[1].args[1]["reason"],
+                         "conversation deleted")
+        # Nothing is left pending to block the shard
+        redis_conn.xack.assert_called_once_with(
+            "chat:ingest:0", ingest.CONSUMER_GROUP,
+            b"1-0", b"2-0", b"3-0", b"4-0", b"5-0")
+
+    def test_receipt_before_the_message_is_persisted(self):
+        agent = User.objects.create_user(
+            username="agent", password="agent123", role=User.Roles.AGENT)
+        items = [self.make_entry(1, "Hello"), self.make_entry(2, "Anyone?")]
+
+        # The agent reads the broadcast frames before the persister runs
+        self.assertTrue(async_to_sync(ChatConsumer().mark_read_up_to)(
+            self.conversation.id, agent, 2))
+        persist_messages.Command().persist(mock.Mock(), "chat:ingest:0",
+                                           items)
+
+        self.assertEqual(
+            set(Message.objects.values_list("status", flat=True)), {"read"})
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.agent_last_read_seq, 2)
+        self.assertEqual(self.conversation.agent_unread_count, 0)
+
+    def test_stream_sequence_continues_from_the_database(self):
+        Conversation.objects.filter(id=self.conversation.id).update(
+            last_seq=5)
+
+        async def enqueue_two():
+            await ingest.get_redis().delete(
+                ingest.seq_key(self.conversation.id))
+            return [
+                await ingest.enqueue_message(
+                    self.conversation.id, self.customer, text, "sent")
+                for text in ["Hello", "Anyone?"]
+            ]
+
+        first, second = async_to_sync(enqueue_two)()
+
+        self.assertEqual((first.seq, second.seq), (6, 7))
+
+    @override_settings(CHAT_INGEST_MODE="stream")
+    def test_rest_and_stream_writes_share_the_sequence(self):
+        key = ingest.stream_key(ingest.shard_for(self.conversation.id))
+        redis_conn = get_redis_connection("default")
+        redis_conn.delete(key, ingest.seq_key(self.conversation.id))
+
+        enqueued = async_to_sync(ingest.enqueue_message)(
+            self.conversation.id, self.customer, "Hello", "sent")
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.post(reverse("message-create"), {
+            "conversation": str(self.conversation.id), "content": "Anyone?",
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((enqueued.seq, response.data["seq"]), (1, 2))
+        # Nothing is stored until the persister runs
+        self.assertFalse(Message.objects.exists())
+
+        # A row written around the stream collides with the first entry
+        clash = Message(conversation=self.conversation, sender=self.customer,
+                        content="clash", seq=1)
+        clash.save()
+        command = persist_messages.Command(stderr=io.StringIO())
+        written = command.persist(mock.MagicMock(), key,
+                                  redis_conn.xrange(key))
+
+        self.assertEqual(written, 1)
+        self.assertEqual(
+            list(Message.objects.order_by("seq").values_list(
+                "content", flat=True)), ["clash", "Anyone?"])
+        self.conversation.refresh_from_db()
+        # Only the stored entry is counted; the other one is dead-lettered
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.agent_unread_count, 1)
+
+    def test_conversation_always_maps_to_the_same_shard(self):
+        shard = ingest.shard_for(self.conversation.id)
+
+        self.assertEqual(shard, ingest.shard_for(str(self.conversation.id)))
+        self.assertIn(ingest.stream_key(shard), ingest.stream_keys())
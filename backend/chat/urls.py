@@ -8,7 +8,8 @@ from .views import (
     AcceptConversationView,
     CloseConversationView,
     get_conversation_messages,
-    supervisor_conversations_view
+    supervisor_conversations_view,
+    chat_metrics_view
 )
 
 
@@ -30,4 +31,5 @@ urlpatterns = [
 
     path("supervisor/conversations/", supervisor_conversations_view,
          name="supervisor-conversations"),
+    path("metrics/", chat_metrics_view, name="chat-metrics"),
 ]
@@ -1,28 +1,59 @@
 # chat/utils.py
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Conversation
 from django.contrib.auth import get_user_model
+from django.db.models import Count, FilteredRelation, Q
+from django_redis import get_redis_connection
+
+from . import inbox, list_cache, participant_cache, presence
+from .models import Conversation
 
 User = get_user_model()
 
 
+def online_agent_usernames():
+    """
+    Usernames of the agents with a live presence lease, from the presence
+    role set (see chat/presence.py).
+    """
+    members = get_redis_connection("default").smembers(
+        presence.role_key("AGENT"))
+    return [member.decode() for member in members]
+
+
+def least_busy_agent(usernames):
+    """
+    The active agent among ``usernames`` with the fewest ASSIGNED
+    conversations, or None. One aggregate query whatever the number of
+    agents; the status is part of the join condition, so only ASSIGNED rows
+    are read from the (agent, status) index and the closed history is never
+    touched.
+    """
+    return User.objects.filter(
+        role=User.Roles.AGENT, is_active=True, username__in=usernames,
+    ).annotate(
+        assigned=FilteredRelation("agent_conversations", condition=Q(
+            agent_conversations__status=Conversation.Status.ASSIGNED)),
+    ).annotate(
+        load=Count("assigned"),
+    ).order_by("load", "username").first()
+
+
 def auto_assign_conversation(conversation):
-    # find all agents
-    agents = User.objects.filter(role="AGENT")
-    # get agent with least open conversations
-    least_busy = min(
-        agents, key=lambda a: a.agent_conversations.filter(status="OPEN").count())
+    """
+    Assign the conversation to the least busy online agent. Returns the
+    agent, or None if no agent is online (the conversation stays queued).
+    """
+    least_busy = least_busy_agent(online_agent_usernames())
+    if least_busy is None:
+        return None
+
+    previous_agent_id = conversation.agent_id
+    was_open = conversation.status == Conversation.Status.OPEN
     conversation.agent = least_busy
+    conversation.status = Conversation.Status.ASSIGNED
     conversation.save()
+    participant_cache.invalidate(conversation.id)
 
-    # Notify agent via channels
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"agent_{least_busy.id}",
-        {
-            "type": "new_conversation",
-            "conversation_id": str(conversation.id),
-            "customer": conversation.customer.username
-        }
-    )
+    # Notify agent inboxes via channels
+    inbox.conversation_assigned(conversation)
+    list_cache.invalidate(previous_agent_id, least_busy.id, open=was_open)
+    return least_busy
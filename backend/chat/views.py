@@ -1,18 +1,24 @@
 from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from rest_framework import status
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
-from drf_spectacular.utils import extend_schema
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils.dateparse import parse_datetime
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 
 from accounts.permissions import IsCustomer, IsAgentOrSupervisor, IsSupervisor
+from chat import (
+    conditional, inbox, ingest, list_cache, metrics, participant_cache
+)
 from chat.models import Conversation, Message
 from chat.serializers import (
-    ConversationSerializer, MessageSerializer, MessageSerializer2,
-    SimpleDetailSerializer
+    ConversationSerializer, ConversationSummarySerializer, MessageSerializer,
+    MessageSerializer2, SimpleDetailSerializer
 )
 # from accounts.permissions import IsCustomer, IsAgentOrSupervisor
 
@@ -21,10 +27,16 @@ class ConversationCreateView(generics.ListCreateAPIView):
     serializer_class = ConversationSerializer
     permission_classes = [IsCustomer]
 
+    def get_serializer_class(self):
+        # Listed as summaries; the history comes from the messages endpoint
+        if self.request.method == "GET":
+            return ConversationSummarySerializer
+        return ConversationSerializer
+
     def get_queryset(self):
         return Conversation.objects.filter(
             customer=self.request.user
-        ).order_by("-created_at")
+        ).with_summary(self.request.user).order_by("-created_at")
 
     def create(self, request, *args, **kwargs):
         # Check for existing open conversation
@@ -48,8 +60,11 @@ class ConversationCreateView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
 
-        return serializer.save(customer=self.request.user,
-                               status=Conversation.Status.OPEN)
+        conversation = serializer.save(customer=self.request.user,
+                                       status=Conversation.Status.OPEN)
+        inbox.conversation_opened(conversation)
+        list_cache.invalidate(open=True)
+        return conversation
 
 
 # class ConversationMessagesView(generics.ListAPIView):
@@ -69,14 +84,81 @@ class ConversationCreateView(generics.ListCreateAPIView):
 
 @extend_schema(
     responses={status.HTTP_200_OK: MessageSerializer2(many=True)},
+    parameters=[
+        OpenApiParameter("before", int, description=(
+            "Only messages with a lower seq: the page before the oldest "
+            "message the client has.")),
+        OpenApiParameter("after", int, description=(
+            "Only messages with a higher seq: what arrived after the newest "
+            "message the client has.")),
+        OpenApiParameter("since", OpenApiTypes.DATETIME, description=(
+            "Only messages stored at or after this time.")),
+        OpenApiParameter("limit", int, description=(
+            "Page size, at most MESSAGES_MAX_PAGE_SIZE.")),
+    ],
     request=None
 )
 @api_view(["GET"])
 def get_conversation_messages(request, conversation_id):
+    """
+    Messages of a conversation in seq order, one page at a time.
+
+    Without ``after``/``since`` the page is the newest ``limit`` messages
+    (before ``before`` if given); with them it is the oldest ``limit``
+    messages after that point. Pages are keyset queries on the
+    (conversation, seq) index, so their cost doesn't grow with the history.
+
+    Responses carry an ETag derived from the conversation's last_seq, so
+    polling an unchanged conversation gets a 304 after one lookup.
+    """
+    params = request.query_params
+    try:
+        limit = min(int(params.get("limit", settings.MESSAGES_PAGE_SIZE)),
+                    settings.MESSAGES_MAX_PAGE_SIZE)
+        before = int(params["before"]) if "before" in params else None
+        after = int(params["after"]) if "after" in params else None
+        since = parse_datetime(params["since"]) if "since" in params \
+            else None
+    except ValueError:
+        since = None
+        limit = 0
+    if limit < 1 or ("since" in params and since is None):
+        return Response(
+            {"detail": "limit, before and after must be positive integers "
+                       "and since an ISO 8601 datetime"},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    # Pages only change when messages are added, i.e. with last_seq
+    last_seq = Conversation.objects.filter(id=conversation_id).values_list(
+        "last_seq", flat=True).first()
+    if last_seq is not None:
+        etag = conditional.etag_for(conversation_id, last_seq,
+                                    request.META.get("QUERY_STRING", ""))
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return response
+
     messages = Message.objects.filter(
-        conversation_id=conversation_id).order_by("timestamp")
-    serializer = MessageSerializer2(messages, many=True)
-    return Response(serializer.data)
+        conversation_id=conversation_id
+    ).select_related("sender").only(
+        "id", "seq", "content", "timestamp", "sender__username")
+    if before is not None:
+        messages = messages.filter(seq__lt=before)
+    if after is not None:
+        messages = messages.filter(seq__gt=after)
+    if since is not None:
+        messages = messages.filter(timestamp__gte=since)
+
+    if after is None and since is None:
+        # Newest page, returned oldest first like the others
+        page = list(messages.order_by("-seq")[:limit])[::-1]
+    else:
+        page = messages.order_by("seq")[:limit]
+    serializer = MessageSerializer2(page, many=True)
+    response = Response(serializer.data)
+    if last_seq is not None:
+        conditional.with_validators(response, etag)
+    return response
 
 
 class MessageCreateView(generics.CreateAPIView):
@@ -84,11 +166,54 @@ class MessageCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
+        if settings.CHAT_INGEST_MODE == "stream":
+            # Through the ingest stream like websocket messages: a direct
+            # insert would take a seq the Redis counter then hands out again
+            data = serializer.validated_data
+            serializer.instance = async_to_sync(ingest.enqueue_message)(
+                data["conversation"].id, self.request.user, data["content"],
+                "sent")
+            return
         serializer.save(sender=self.request.user)
 
 
+def list_etag(scope, queryset):
+    """
+    ETag of a conversation list from one aggregate query.
+    Every change to a listed conversation bumps its updated_at, and one
+    entering or leaving the list changes the count or the latest
+    updated_at.
+    """
+    state = queryset.order_by().aggregate(count=Count("*"),
+                                          latest=Max("updated_at"))
+    return conditional.etag_for(scope, state["count"], state["latest"])
+
+
+def cached_list_response(request, scope, queryset, serialize):
+    """
+    The conversation list of ``scope`` from the shared list cache, built
+    with ``serialize(queryset)`` and stored on a miss. A hit answers without
+    touching the database, a 304 included.
+    """
+    key, entry = list_cache.lookup(scope)
+    if entry is None:
+        etag = list_etag(scope, queryset)
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return response
+        entry = {"etag": etag, "data": list(serialize(queryset))}
+        list_cache.store(key, entry)
+    else:
+        response = conditional.not_modified(request, entry["etag"])
+        if response is not None:
+            return response
+
+    response = Response(entry["data"], status=status.HTTP_200_OK)
+    return conditional.with_validators(response, entry["etag"])
+
+
 class AgentConversationsView(generics.ListAPIView):
-    serializer_class = ConversationSerializer
+    serializer_class = ConversationSummarySerializer
     permission_classes = [IsAgentOrSupervisor]
 
     def get_queryset(self):
@@ -96,9 +221,15 @@ class AgentConversationsView(generics.ListAPIView):
         if user.role != "AGENT" and user.role != "SUPERVISOR":
             return Conversation.objects.none()
         # print(Conversation.objects.filter(status="OPEN", agent__isnull=True))
-        return (Conversation.objects.filter(status="OPEN")
-                |
-                Conversation.objects.filter(agent=user, status="ASSIGNED"))
+        return Conversation.objects.filter(
+            Q(status="OPEN") | Q(agent=user, status="ASSIGNED")
+        ).with_summary(user).order_by("-updated_at")
+
+    def list(self, request, *args, **kwargs):
+        return cached_list_response(
+            request, list_cache.agent_part(request.user.id),
+            self.get_queryset(),
+            lambda queryset: self.get_serializer(queryset, many=True).data)
 
 
 class AcceptConversationView(APIView):
@@ -132,20 +263,16 @@ class AcceptConversationView(APIView):
             #     return Response({"detail": "Conversation already assigned"},
             #                     status=400)
 
+            previous_agent_id = convo.agent_id
+            was_open = convo.status == Conversation.Status.OPEN
             convo.agent = user
             convo.status = Conversation.Status.ASSIGNED
             convo.save()
+            participant_cache.invalidate(convo.id)
 
-            # Notify agent group via Channels
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"agent_{user.id}",
-                {
-                    "type": "new_conversation",
-                    "conversation_id": str(convo.id),
-                    "customer": convo.customer.username
-                }
-            )
+            # Notify every agent inbox via Channels
+            inbox.conversation_assigned(convo)
+            list_cache.invalidate(previous_agent_id, user.id, open=was_open)
 
             return Response({"detail": "Conversation accepted"})
         except Exception as e:
@@ -169,13 +296,17 @@ class CloseConversationView(APIView):
         except Conversation.DoesNotExist:
             return Response({"detail": "Not found"}, status=404)
 
+        was_open = convo.status == Conversation.Status.OPEN
         convo.status = Conversation.Status.CLOSED
         convo.save()
+        participant_cache.invalidate(convo.id)
+        inbox.conversation_closed(convo)
+        list_cache.invalidate(convo.agent_id, open=was_open)
         return Response({"detail": "Conversation closed"})
 
 
 @extend_schema(
-    responses={status.HTTP_200_OK: ConversationSerializer(many=True)},
+    responses={status.HTTP_200_OK: ConversationSummarySerializer(many=True)},
     request=None
 )
 @api_view(["GET"])
@@ -187,7 +318,24 @@ def supervisor_conversations_view(request):
     """
     convos = Conversation.objects.filter(
         status__in=[Conversation.Status.OPEN, Conversation.Status.ASSIGNED]) \
-        .order_by("-updated_at")
-    serializer = ConversationSerializer(
-        convos, many=True, context={"request": request})
-    return Response(serializer.data, status=status.HTTP_200_OK)
+        .with_summary(request.user).order_by("-updated_at")
+    # The same list for every supervisor
+    return cached_list_response(
+        request, "supervisor", convos,
+        lambda queryset: ConversationSummarySerializer(
+            queryset, many=True, context={"request": request}).data)
+
+
+@extend_schema(
+    responses={status.HTTP_200_OK: {"type": "object",
+                                    "additionalProperties": {
+                                        "type": "integer"}}},
+    request=None
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsSupervisor])
+def chat_metrics_view(request):
+    """
+    Return the chat counters of the worker that served the request.
+    """
+    return Response(metrics.snapshot(), status=status.HTTP_200_OK)
@@ -109,6 +109,24 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
 }
 
+# Default and max page size of the conversation messages endpoint
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+
+# User directory page sizes, and where counting stops when the database
+# can't estimate (see accounts/pagination.py)
+USERS_PAGE_SIZE = 50
+USERS_MAX_PAGE_SIZE = 200
+USERS_COUNT_LIMIT = 10000
+
+# Upper bound on how long a cached agent/supervisor conversation list is
+# kept; changes invalidate it earlier (see chat/list_cache.py)
+CHAT_LIST_CACHE_TTL = 60
+
+# How long a conversation's participants stay cached for websocket
+# authorization; accept/close/assign invalidate them (chat/participant_cache)
+CHAT_PARTICIPANTS_TTL = 300
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Customer Support Chat API',
     'DESCRIPTION': 'API documentation',
@@ -194,11 +212,75 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# Users resolved from access tokens are cached per process for
+# PRINCIPAL_LOCAL_TTL seconds (at most PRINCIPAL_CACHE_SIZE of them) and in
+# the shared cache for PRINCIPAL_CACHE_TTL; see accounts/principals.py
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_LOCAL_TTL = 5
+PRINCIPAL_CACHE_TTL = 300
+
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/1")
+# Size of the shared asyncio Redis pool used by the websocket consumers
+REDIS_MAX_CONNECTIONS = 50
+
+# How ChatConsumer persists chat lines:
+#   "direct" - insert into Postgres before broadcasting (default)
+#   "stream" - append to a sharded Redis Stream, broadcast immediately and
+#              let `manage.py persist_messages` write them in batches
+CHAT_INGEST_MODE = os.environ.get("CHAT_INGEST_MODE", "direct")
+CHAT_INGEST_SHARDS = 4
+# In "stream" mode message sequence numbers come from Redis counters kept
+# for this long (seconds) after a conversation's last message. Clear the
+# chat:seq:* keys when switching back to "stream" after running "direct".
+CHAT_SEQ_TTL = 7 * 24 * 3600
+# Entries persist_messages can't store (deleted conversation or sender,
+# unparsable) are moved to the chat:ingest:dead stream, capped at about
+# this many entries
+CHAT_DEAD_LETTER_LENGTH = 10000
+
+# Typing indicators: re-send "typing.start" at most this often (seconds)
+# and emit "typing.stop" if the client goes quiet for TYPING_TIMEOUT.
+TYPING_START_INTERVAL = 3
+TYPING_TIMEOUT = 5
+
+# Message retry deduplication: recently seen client ids kept per socket, and
+# how long (seconds) a client id is reserved in Redis in "stream" ingest mode
+CLIENT_ID_CACHE_SIZE = 256
+CLIENT_ID_TTL = 24 * 3600
+
+# Presence changes are batched for this long (seconds) before supervisors
+# get them; this many batches are kept for version-based resync.
+PRESENCE_FLUSH_INTERVAL = 0.5
+PRESENCE_DIFF_HISTORY = 1000
+
+# Every connection holds a presence lease renewed by its worker every
+# PRESENCE_HEARTBEAT_INTERVAL seconds; leases not renewed within
+# PRESENCE_LEASE_TTL are expired by `manage.py sweep_presence`.
+PRESENCE_HEARTBEAT_INTERVAL = 10
+PRESENCE_LEASE_TTL = 30
+
+# Supervisors connecting within this many seconds of each other share one
+# encoded presence snapshot
+PRESENCE_SNAPSHOT_TTL = 1
+
+# Per-conversation replay buffer for reconnecting sockets: about
+# CHAT_REPLAY_LENGTH recent events, kept for CHAT_REPLAY_TTL seconds after
+# the last one. Older cursors fall back to at most CHAT_REPLAY_DB_LIMIT
+# messages from the database, reaching CHAT_REPLAY_CLOCK_SKEW seconds
+# further back to cover clock skew between Redis and the app servers.
+CHAT_REPLAY_LENGTH = 500
+CHAT_REPLAY_TTL = 24 * 3600
+CHAT_REPLAY_DB_LIMIT = 200
+CHAT_REPLAY_CLOCK_SKEW = 5
+
+# Max conversations a single multiplexed socket (ws/chat/) may subscribe to
+MULTIPLEX_MAX_CONVERSATIONS = 20
 
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/1",
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
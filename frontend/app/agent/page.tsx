@@ -6,9 +6,11 @@ import Navbar from "@/components/Navbar";
 import Sidebar from "@/components/Sidebar";
 import ChatWindow from "@/components/ChatWindow";
 import ChatInput from "@/components/ChatInput";
-import { chatApi } from "@/services/api";
+import { chatApi, MESSAGES_PAGE_SIZE } from "@/services/api";
 
 interface Message {
+    id?: string;
+    seq?: number;
     timestamp?: string;
     sender: string;
     content?: string;
@@ -30,6 +32,7 @@ export default function AgentPage() {
     const [conversations, setConversations] = useState<Conversation[]>([]);
     const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null);
     const [messages, setMessages] = useState<Message[]>([]);
+    const [hasOlder, setHasOlder] = useState(false);
     const [socket, setSocket] = useState<WebSocket | null>(null);
     const [typingUser, setTypingUser] = useState<string | null>(null);
     const [loading, setLoading] = useState(true);
@@ -56,13 +59,30 @@ export default function AgentPage() {
     /** 🟩 Fetch messages for selected conversation */
     const fetchMessages = async (conversationId: string) => {
         try {
-            const data = await chatApi.getMessages(conversationId);
+            const data = await chatApi.getMessages(conversationId, { limit: MESSAGES_PAGE_SIZE });
             setMessages(data);
+            setHasOlder(data.length === MESSAGES_PAGE_SIZE);
         } catch (err) {
             console.error("Failed to fetch messages:", err);
         }
     };
 
+    /** ⬆️ Load the page of history before the oldest message shown */
+    const loadOlderMessages = async () => {
+        const oldest = messages.find((m) => m.seq)?.seq;
+        if (!selectedConversation || !oldest) return;
+        try {
+            const older: Message[] = await chatApi.getMessages(selectedConversation.id, {
+                before: oldest,
+                limit: MESSAGES_PAGE_SIZE,
+            });
+            setMessages((prev) => [...older, ...prev]);
+            setHasOlder(older.length === MESSAGES_PAGE_SIZE);
+        } catch (err) {
+            console.error("Failed to fetch older messages:", err);
+        }
+    };
+
     /** 🧠 Load conversations once */
     useEffect(() => {
         fetchConversations();
@@ -191,7 +211,12 @@ export default function AgentPage() {
                                 )}
                             </div>
 
-                            <ChatWindow messages={messages} typingUser={typingUser} />
+                            <ChatWindow
+                                messages={messages}
+                                typingUser={typingUser}
+                                hasOlder={hasOlder}
+                                onLoadOlder={loadOlderMessages}
+                            />
 
                             <ChatInput
                                 onSend={sendMessage}
@@ -7,9 +7,11 @@ import { useRouter } from "next/navigation";
 import ChatWindow from "@/components/ChatWindow";
 import ChatInput from "@/components/ChatInput";
 
-import { chatApi } from "@/services/api";
+import { chatApi, MESSAGES_PAGE_SIZE } from "@/services/api";
 
 interface Message {
+    id?: string;
+    seq?: number;
     timestamp?: string;
     sender: string;
     content?: string;
@@ -18,21 +20,35 @@ interface Message {
     status: string
 }
 
+// Replay cursors are Redis stream ids: "<milliseconds>-<sequence>"
+const compareCursors = (a: string, b: string) => {
+    const [aMs, aSeq] = a.split("-").map(Number);
+    const [bMs, bSeq] = b.split("-").map(Number);
+    return aMs - bMs || aSeq - bSeq;
+};
+
 export default function CustomerChatPage() {
     const router = useRouter();
 
     const { conversationId } = useParams();
     const [messages, setMessages] = useState<Message[]>([]);
+    const [hasOlder, setHasOlder] = useState(false);
     const [socket, setSocket] = useState<WebSocket | null>(null);
     const [loading, setLoading] = useState(true);
     const [typingUser, setTypingUser] = useState<string | null>(null);
     const typingTimeoutRef = useRef<NodeJS.Timeout | null>(null);
     const isTypingRef = useRef(false);
+    // Highest cursor of the replayable frames received, sent on reconnect
+    const cursorRef = useRef<string | null>(null);
+    // Highest message sequence number seen
+    const lastSeqRef = useRef(0);
 
     const fetchMessages = async (conversationId: string) => {
         try {
-            const data = await chatApi.getMessages(conversationId);
+            const data: Message[] = await chatApi.getMessages(conversationId, { limit: MESSAGES_PAGE_SIZE });
+            lastSeqRef.current = data.reduce((max, m) => Math.max(max, m.seq ?? 0), 0);
             setMessages(data);
+            setHasOlder(data.length === MESSAGES_PAGE_SIZE);
         } catch (err: any) {
             if (err.response?.status === 403) {
                 console.warn("Access denied — redirecting to login.");
@@ -49,33 +65,93 @@ export default function CustomerChatPage() {
         if (!conversationId) return;
 
         fetchMessages(conversationId as string);
+        cursorRef.current = null;
 
         const wsScheme = window.location.protocol === "https:" ? "wss" : "ws";
-        const socketUrl = `${wsScheme}://localhost:8000/ws/chat/${conversationId}/`;
-        const chatSocket = new WebSocket(socketUrl);
-
-        chatSocket.onopen = () => console.log("WebSocket connected");
-
-        chatSocket.onmessage = (e) => {
-            const data = JSON.parse(e.data);
+        let chatSocket: WebSocket;
+        let reconnectTimer: NodeJS.Timeout | null = null;
+        let closed = false;
+
+        const connect = () => {
+            // Resume from the last applied cursor so only missed events
+            // are replayed instead of reloading the whole history
+            const cursor = cursorRef.current;
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+            chatSocket = new WebSocket(
+                `${wsScheme}://localhost:8000/ws/chat/${conversationId}/${query}`
+            );
 
-            if (data.type === "typing.start") {
-                setTypingUser(data.user);
-            } else if (data.type === "typing.stop") {
-                setTypingUser(null);
-            } else if (data.type === "message" || data.content) {
-                setMessages((prev) => [...prev, data]);
-            }
+            chatSocket.onopen = () => console.log("WebSocket connected");
+
+            chatSocket.onmessage = (e) => {
+                const data = JSON.parse(e.data);
+
+                // The cursor is only where to resume from. Frames from
+                // different workers can arrive out of cursor order, so none
+                // is dropped for it: messages are deduplicated by id instead.
+                if (data.cursor && (!cursorRef.current || compareCursors(data.cursor, cursorRef.current) > 0)) {
+                    cursorRef.current = data.cursor;
+                }
+
+                if (data.type === "typing.start") {
+                    setTypingUser(data.user);
+                } else if (data.type === "typing.stop") {
+                    setTypingUser(null);
+                } else if (data.type === "replay.done") {
+                    // Missed too much for a replay; reload the history
+                    if (!data.complete) fetchMessages(conversationId as string);
+                } else if (data.type === "message" || data.content) {
+                    // Sequence numbers have no gaps; a jump means a message
+                    // was missed, so reload the history
+                    if (data.seq && lastSeqRef.current && data.seq > lastSeqRef.current + 1) {
+                        fetchMessages(conversationId as string);
+                    }
+                    lastSeqRef.current = Math.max(lastSeqRef.current, data.seq ?? 0);
+                    setMessages((prev) =>
+                        data.id && prev.some((m) => m.id === data.id)
+                            ? prev
+                            : [...prev, data].sort((a, b) => (a.seq ?? 0) - (b.seq ?? 0))
+                    );
+                }
+            };
+
+            chatSocket.onclose = () => {
+                console.log("WebSocket disconnected");
+                if (!closed) reconnectTimer = setTimeout(connect, 1000);
+            };
+
+            setSocket(chatSocket);
         };
 
-        chatSocket.onclose = () => console.log("WebSocket disconnected");
-
-        setSocket(chatSocket);
+        connect();
         setLoading(false);
 
-        return () => chatSocket.close();
+        return () => {
+            closed = true;
+            if (reconnectTimer) clearTimeout(reconnectTimer);
+            chatSocket.close();
+        };
     }, [conversationId]);
 
+    // Load the page of history before the oldest message shown
+    const loadOlderMessages = async () => {
+        const oldest = messages.find((m) => m.seq)?.seq;
+        if (!oldest) return;
+        try {
+            const older: Message[] = await chatApi.getMessages(conversationId as string, {
+                before: oldest,
+                limit: MESSAGES_PAGE_SIZE,
+            });
+            setMessages((prev) => [
+                ...older.filter((m) => !prev.some((p) => p.id === m.id)),
+                ...prev,
+            ]);
+            setHasOlder(older.length === MESSAGES_PAGE_SIZE);
+        } catch (err) {
+            console.error("Failed to fetch older messages:", err);
+        }
+    };
+
     const sendMessage = (msg: string) => {
         if (!socket) return;
         const payload = { type: "message", message: msg };
@@ -119,7 +195,12 @@ export default function CustomerChatPage() {
                         Chat Session
                     </h1>
 
-                    <ChatWindow messages={messages} typingUser={typingUser} />
+                    <ChatWindow
+                        messages={messages}
+                        typingUser={typingUser}
+                        hasOlder={hasOlder}
+                        onLoadOlder={loadOlderMessages}
+                    />
 
                     <ChatInput
                         onSend={sendMessage}
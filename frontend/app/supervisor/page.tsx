@@ -4,7 +4,7 @@ import { useState, useEffect, useRef } from "react";
 import { useRouter } from "next/navigation";
 import ChatWindow from "@/components/ChatWindow";
 import ChatInput from "@/components/ChatInput";
-import { chatApi } from "@/services/api";
+import { chatApi, MESSAGES_PAGE_SIZE } from "@/services/api";
 
 interface Conversation {
     id: string;
@@ -14,6 +14,8 @@ interface Conversation {
 }
 
 interface Message {
+    id?: string;
+    seq?: number;
     timestamp?: string;
     sender: string;
     content?: string;
@@ -27,20 +29,33 @@ interface OnlineUser {
     role: string;
 }
 
+interface PresenceDiff {
+    version: number;
+    // Online users per role as of this version
+    counts: Record<string, number>;
+    online: OnlineUser[];
+    offline: string[];
+}
+
 export default function SupervisorDashboard() {
     const router = useRouter();
 
     const [conversations, setConversations] = useState<Conversation[]>([]);
     const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null);
     const [messages, setMessages] = useState<Message[]>([]);
+    const [hasOlder, setHasOlder] = useState(false);
     const [socket, setSocket] = useState<WebSocket | null>(null);
     const [typingUser, setTypingUser] = useState<string | null>(null);
     const [onlineUsers, setOnlineUsers] = useState<OnlineUser[]>([]);
+    const [onlineCounts, setOnlineCounts] = useState<Record<string, number>>({});
+    // Next SSCAN cursor for online customers, null once all are loaded
+    const [customerCursor, setCustomerCursor] = useState<number | null>(null);
     const [joined, setJoined] = useState(false);
     const [loading, setLoading] = useState(true);
 
     const typingTimeoutRef = useRef<NodeJS.Timeout | null>(null);
     const isTypingRef = useRef(false);
+    const presenceSocketRef = useRef<WebSocket | null>(null);
 
     // --- Fetch Supervisor Conversations ---
     const fetchConversations = async () => {
@@ -62,13 +77,30 @@ export default function SupervisorDashboard() {
     // --- Fetch Messages for a Conversation ---
     const fetchMessages = async (conversationId: string) => {
         try {
-            const data = await chatApi.getMessages(conversationId);
+            const data = await chatApi.getMessages(conversationId, { limit: MESSAGES_PAGE_SIZE });
             setMessages(data);
+            setHasOlder(data.length === MESSAGES_PAGE_SIZE);
         } catch (err) {
             console.error("Failed to fetch messages:", err);
         }
     };
 
+    // --- Load the page of history before the oldest message shown ---
+    const loadOlderMessages = async () => {
+        const oldest = messages.find((m) => m.seq)?.seq;
+        if (!selectedConversation || !oldest) return;
+        try {
+            const older: Message[] = await chatApi.getMessages(selectedConversation.id, {
+                before: oldest,
+                limit: MESSAGES_PAGE_SIZE,
+            });
+            setMessages((prev) => [...older, ...prev]);
+            setHasOlder(older.length === MESSAGES_PAGE_SIZE);
+        } catch (err) {
+            console.error("Failed to fetch older messages:", err);
+        }
+    };
+
     useEffect(() => {
         fetchConversations();
     }, []);
@@ -111,23 +143,63 @@ export default function SupervisorDashboard() {
 
         presenceSocket.onopen = () => console.log("Connected to presence WebSocket");
 
+        // Last presence diff version applied; a gap triggers a resync
+        let presenceVersion = 0;
+
+        const applyDiff = (diff: PresenceDiff) => {
+            if (diff.version <= presenceVersion) return;
+            presenceVersion = diff.version;
+            const changed = new Set([
+                ...diff.online.map((u) => u.username),
+                ...diff.offline,
+            ]);
+            // Overwritten, not adjusted: the snapshot may already include
+            // the changes of the first diffs after it
+            setOnlineCounts(diff.counts);
+            setOnlineUsers((prev) => [
+                ...prev.filter((u) => !changed.has(u.username)),
+                ...diff.online,
+            ]);
+        };
+
         presenceSocket.onmessage = (event) => {
             const data = JSON.parse(event.data);
 
             if (data.type === "presence.snapshot") {
+                presenceVersion = data.version;
                 setOnlineUsers(data.users);
-            } else if (data.type === "presence.online") {
+                setOnlineCounts(data.counts);
+                // Customers are loaded page by page
+                presenceSocket.send(JSON.stringify({
+                    type: "presence.page",
+                    role: "CUSTOMER",
+                    cursor: 0,
+                }));
+            } else if (data.type === "presence.page") {
+                const page: OnlineUser[] = data.users;
+                const names = new Set(page.map((u) => u.username));
                 setOnlineUsers((prev) => [
-                    ...prev.filter((u) => u.username !== data.user),
-                    { username: data.user, role: data.role },
+                    ...prev.filter((u) => !names.has(u.username)),
+                    ...page,
                 ]);
-            } else if (data.type === "presence.offline") {
-                setOnlineUsers((prev) => prev.filter((u) => u.username !== data.user));
+                setCustomerCursor(data.cursor === 0 ? null : data.cursor);
+            } else if (data.type === "presence.diff") {
+                if (data.version > presenceVersion + 1) {
+                    presenceSocket.send(JSON.stringify({
+                        type: "presence.resync",
+                        version: presenceVersion,
+                    }));
+                    return;
+                }
+                applyDiff(data);
+            } else if (data.type === "presence.diffs") {
+                data.batches.forEach(applyDiff);
             }
         };
 
         presenceSocket.onclose = () => console.log("Presence WebSocket disconnected");
 
+        presenceSocketRef.current = presenceSocket;
         return () => presenceSocket.close();
     }, []);
 
@@ -156,6 +228,16 @@ export default function SupervisorDashboard() {
 
     const handleJoinChat = () => setJoined(true);
 
+    const loadMoreCustomers = () => {
+        const presenceSocket = presenceSocketRef.current;
+        if (!presenceSocket || customerCursor === null) return;
+        presenceSocket.send(JSON.stringify({
+            type: "presence.page",
+            role: "CUSTOMER",
+            cursor: customerCursor,
+        }));
+    };
+
     if (loading) return <p className="text-center mt-10">Loading supervisor dashboard...</p>;
 
     return (
@@ -166,6 +248,11 @@ export default function SupervisorDashboard() {
                     {/* Online Users */}
                     <div className="mb-4">
                         <h2 className="text-lg font-bold text-green-700 mb-2">Online Users</h2>
+                        <p className="text-xs text-gray-500 mb-2">
+                            {Object.entries(onlineCounts)
+                                .map(([role, count]) => `${role}: ${count}`)
+                                .join(" · ")}
+                        </p>
                         {onlineUsers.length === 0 ? (
                             <p className="text-gray-500 text-sm">No users online</p>
                         ) : (
@@ -182,6 +269,14 @@ export default function SupervisorDashboard() {
                                 ))}
                             </ul>
                         )}
+                        {customerCursor !== null && (
+                            <button
+                                onClick={loadMoreCustomers}
+                                className="mt-2 text-xs text-blue-600 hover:underline"
+                            >
+                                Load more customers
+                            </button>
+                        )}
                     </div>
 
                     {/* Active Conversations */}
@@ -226,7 +321,12 @@ export default function SupervisorDashboard() {
                                 )}
                             </div>
 
-                            <ChatWindow messages={messages} typingUser={typingUser} />
+                            <ChatWindow
+                                messages={messages}
+                                typingUser={typingUser}
+                                hasOlder={hasOlder}
+                                onLoadOlder={loadOlderMessages}
+                            />
 
                             {joined && (
                                 <ChatInput
@@ -14,17 +14,30 @@ interface Message {
 interface ChatWindowProps {
     messages: Message[];
     typingUser?: string | null;
+    // Shown as a "Load older messages" button above the history
+    hasOlder?: boolean;
+    onLoadOlder?: () => void;
 }
 
-export default function ChatWindow({ messages, typingUser }: ChatWindowProps) {
+export default function ChatWindow({ messages, typingUser, hasOlder, onLoadOlder }: ChatWindowProps) {
     const bottomRef = useRef<HTMLDivElement>(null);
+    const newest = messages[messages.length - 1];
 
+    // Only follow new messages, not older pages prepended above
     useEffect(() => {
         bottomRef.current?.scrollIntoView({ behavior: "smooth" });
-    }, [messages, typingUser]);
+    }, [newest, typingUser]);
 
     return (
         <div className="flex-1 overflow-y-auto p-4 space-y-3 bg-blue-50 rounded-lg border border-blue-200">
+            {hasOlder && onLoadOlder && (
+                <button
+                    onClick={onLoadOlder}
+                    className="w-full text-xs text-blue-600 hover:underline"
+                >
+                    Load older messages
+                </button>
+            )}
             {messages.map((msg, index) => (
                 <div key={index} className="flex flex-col">
                     <span className="text-sm text-gray-500">{msg.sender}</span>
@@ -11,6 +11,10 @@ export const api = axios.create({
 });
 
 
+// Messages per history page (the backend's MESSAGES_PAGE_SIZE). A full
+// page means older messages may be left to load with `before`.
+export const MESSAGES_PAGE_SIZE = 50;
+
 export const chatApi = {
   async startConversation() {
     const response = await api.post("/api/chat/conversations/", {});
@@ -26,9 +30,14 @@ export const chatApi = {
     return data;
   },
 
-  // Fetch message history for a given conversation
-  async getMessages(conversationId: string) {
-    const res = await api.get(`/api/chat/messages/${conversationId}/`);
+  // Fetch a page of message history for a given conversation: the newest
+  // messages by default, older ones with `before` (the oldest seq loaded)
+  // and newer ones with `after` (the newest seq loaded)
+  async getMessages(
+    conversationId: string,
+    params: { before?: number; after?: number; limit?: number } = {}
+  ) {
+    const res = await api.get(`/api/chat/messages/${conversationId}/`, { params });
     return res.data;
   },
 